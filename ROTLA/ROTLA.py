@@ -4,14 +4,40 @@ import sys
 import os
 import argparse
 import copy
-import gzip
+import hashlib
 import re
+import resource
 
-from subprocess import call
-from collections import defaultdict
+import numpy
+
+from multiprocessing import Pool
+from collections import defaultdict, OrderedDict
+from distutils.spawn import find_executable
+from itertools import izip_longest
 from __init__ import PATHS
+from aligned_bases_from_psl import AlignedBaseCounter, count_aligned_bases, print_aligned_bases, read_pair_copies
+from alignment_store import AlignmentStore, input_key
+from blat import run_blat
+from blat_cache import BlatCache
+from fastq import open_gzip
+from interval_index import last_contained, shifted_overlaps
+from kmer_aligner import KmerAligner, PSL_HEADER, ALIGN_BATCH_SIZE, init_align_worker, align_batch
+from metrics import Metrics
+from output import open_output, write_lines
+from prescreen import KmerIndex
+from reference import Reference
+from reference_index import ReferenceIndex
 
 class ROTLA(object):
+
+    # Backends for --aligner. Each is a method taking the padded reference
+    # file and sequence that writes the read 1 and read 2 PSL files for the
+    # pairs readPairs passes on, listing each query's hits together in
+    # FASTQ order.
+    ALIGNERS = {
+        'blat': 'alignWithBLAT',
+        'kmer': 'alignWithKmers',
+    }
     
     def __init__(self, **kwargs):
         
@@ -19,9 +45,23 @@ class ROTLA(object):
         self.read_1_fn = kwargs['read_1_file_name']
         self.read_2_fn = kwargs['read_2_file_name']
         self.ref_fn = kwargs['reference_sequence']
+        self.contig = kwargs['contig']
         self.output_header = kwargs['output_prefix']
         self.blat_path = PATHS['blat']
         self.required_alignment_length = kwargs['length']
+        self.threads = kwargs['threads']
+        self.blat_chunks = kwargs['blat_chunks']
+        self.blat_jobs = kwargs['blat_jobs']
+        self.stream_fasta = kwargs['stream_fasta']
+        self.prescreen = kwargs['prescreen']
+        self.prescreen_mismatches = kwargs['prescreen_mismatches']
+        self.aligned_bases = kwargs['aligned_bases']
+        self.alignment_cache = kwargs['alignment_cache']
+        self.blat_cache = kwargs['blat_cache']
+        self.blat_cache_size = kwargs['blat_cache_size']
+        self.aligner = kwargs['aligner']
+        self.collapse_duplicates = kwargs['collapse_duplicates']
+        self.profile = kwargs['profile']
         
         # File checks
         for fn in [
@@ -32,33 +72,39 @@ class ROTLA(object):
         ]:
             os.path.exists(fn)
         
-        self.alignment = dict()
+        self.alignment = AlignmentStore()
         self.breakpoints = dict()
         self.break_count = defaultdict(int)
+        self.reference = None
+        self.reference_index = None
+        self.kmer_index = None
+        self.kmer_aligner = None
+        self.aligned_base_counter = None
+        self.blat_cached = False
+        self.pairs_written = 0
+        self.metrics = Metrics(
+            'find-breakpoints',
+            self.output_header + ".profile" if self.profile else None,
+        )
+        self.prescreen_stats = {
+            'pairs': 0,
+            'skipped_pairs': 0,
+            'skipped_aligned_bases': 0,
+        }
+        self.pair_keys = dict()
+        self.pair_copies = dict()
+        self.unique_break_count = defaultdict(int) if self.collapse_duplicates else None
+        self.duplicate_stats = {
+            'unique_pairs': 0,
+            'unique_skipped_aligned_bases': 0,
+        }
         
         self.execute()
         
-    @staticmethod
-    def readReference(fasta_file):
-        reference = ""
-        header_count = 0
-        
-        with open(fasta_file) as f:
-            for line in f:
-                if line[0] != ">":
-                    reference += line.strip()
-                else:
-                    header_count += 1
-                
-                if header_count > 1:
-                    raise StandardError('FASTA contains two headers.')
-        
-        return reference.upper()
-
     @staticmethod
     def flex_open(fq):
         if re.search("\.fastq\.gz$", fq):
-            handle = gzip.open(fq)
+            handle = open_gzip(fq)
         elif re.search("\.fastq$", fq):
             handle = open(fq)
         else:
@@ -67,190 +113,384 @@ class ROTLA(object):
         return handle
 
     @staticmethod
-    def makeFASTA(fastq_file, fasta_file):
+    def readFASTQ(fastq_file):
+        # Yield the header and sequence lines of each FASTQ record
         count = 0
-        with ROTLA.flex_open(fastq_file) as fastq, open(fasta_file, "w") as fasta:
+        with ROTLA.flex_open(fastq_file) as fastq:
             for line in fastq:
                 if count % 4 == 0:
-                    fasta.write("> " + line.strip() + "\n")
+                    header = line
                 if count % 4 == 1:
-                    fasta.write(line)
+                    yield header, line
                 count += 1
+
+    def prescreenPair(self, records):
+        # A pair whose mates both align end to end cannot show a split, so
+        # its aligned bases are counted instead of sending it to BLAT.
+        # Returns them, or None if the pair must be aligned.
+        blocks = set()
+        for header, sequence in records:
+            matches = self.kmer_index.contiguousMatches(sequence.strip(), self.prescreen_mismatches)
+            if not matches:
+                return None
+            blocks |= matches
+
+        return count_aligned_bases({None: blocks}, self.ref_seq_length)
+
+    def readPairs(self):
+        # Header and sequence records of each read pair, less the pairs the
+        # prescreen holds back. When collapsing duplicates, a pair with the
+        # same sequences as one seen before is not passed on but counted as
+        # another copy of it.
+        for records in izip_longest(self.readFASTQ(self.read_1_fn), self.readFASTQ(self.read_2_fn)):
+            self.prescreen_stats['pairs'] += 1
+
+            if self.collapse_duplicates:
+                key = hashlib.md5('\t'.join(record[1] if record else '' for record in records)).digest()
+                if key in self.pair_keys:
+                    self.addPairCopy(*self.pair_keys[key])
+                    continue
+
+            skipped_bases = None
+            if self.kmer_index and None not in records:
+                skipped_bases = self.prescreenPair(records)
+                if skipped_bases is not None:
+                    self.prescreen_stats['skipped_pairs'] += 1
+                    self.prescreen_stats['skipped_aligned_bases'] += skipped_bases
+
+            if self.collapse_duplicates:
+                name = [record for record in records if record][0][0].split()[0]
+                self.pair_keys[key] = (name, skipped_bases)
+                self.duplicate_stats['unique_pairs'] += 1
+                if skipped_bases is not None:
+                    self.duplicate_stats['unique_skipped_aligned_bases'] += skipped_bases
+
+            if skipped_bases is None:
+                yield records
+
+    def addPairCopy(self, name, skipped_bases):
+        # Count a repeat of the first pair with these sequences, as the
+        # prescreen counted that pair
+        if skipped_bases is None:
+            self.pair_copies[name] = self.pair_copies.get(name, 1) + 1
+        else:
+            self.prescreen_stats['skipped_pairs'] += 1
+            self.prescreen_stats['skipped_aligned_bases'] += skipped_bases
+
+    def writeFASTA(self, fasta_handles):
+        # fasta_handles holds the read 1 and the read 2 FASTA handles. Pairs
+        # are dealt to them STREAM_BATCH_SIZE at a time, in turn, so both
+        # mates are spread over their handles the same way.
+        count = 0
+        for records in self.readPairs():
+            for record, handles in zip(records, fasta_handles):
+                if record:
+                    fasta = handles[(count // STREAM_BATCH_SIZE) % len(handles)]
+                    fasta.write("> " + record[0].strip() + "\n")
+                    fasta.write(record[1])
+            count += 1
+
+        self.pairs_written = count
+
+    def printPrescreenStats(self):
+        with open(self.output_header + ".prescreen.txt", "w") as OUTPUT:
+            for key in ['pairs', 'skipped_pairs', 'skipped_aligned_bases']:
+                OUTPUT.write('{}\t{}\n'.format(key, self.prescreen_stats[key]))
     
-    @staticmethod
-    def makePaddedFASTA(fasta_file, output_file):
-        reference_sequence = ROTLA.readReference(fasta_file)
-        
-        with open(output_file, "w") as OUTPUT:
-            OUTPUT.write("> Padded reference\n")
-            OUTPUT.write(reference_sequence + reference_sequence + "\n")
+    def readPrescreenStats(self):
+        with open(self.output_header + ".prescreen.txt") as f:
+            for line in f:
+                key, value = line.strip().split('\t')
+                self.prescreen_stats[key] = int(value)
+
+    def printDuplicates(self):
+        # Copies of every aligned pair that stands for more than one, by
+        # name, and the counts of unique pairs
+        with open(self.output_header + ".pair_copies.txt", "w") as OUTPUT:
+            for name, copies in sorted(self.pair_copies.items(), key=lambda k: k[0]):
+                OUTPUT.write('{}\t{}\n'.format(name, copies))
+
+        with open(self.output_header + ".duplicates.txt", "w") as OUTPUT:
+            OUTPUT.write('{}\t{}\n'.format('pairs', self.prescreen_stats['pairs']))
+            for key in ['unique_pairs', 'unique_skipped_aligned_bases']:
+                OUTPUT.write('{}\t{}\n'.format(key, self.duplicate_stats[key]))
+
+    def readDuplicates(self):
+        self.pair_copies = read_pair_copies(self.output_header + ".pair_copies.txt")
+        with open(self.output_header + ".duplicates.txt") as f:
+            for line in f:
+                key, value = line.strip().split('\t')
+                if key in self.duplicate_stats:
+                    self.duplicate_stats[key] = int(value)
 
     def cleanFASTA(self):
         os.remove(self.output_header + ".padded_reference.fasta")
-        os.remove(self.output_header + ".read_1.fasta")
-        os.remove(self.output_header + ".read_2.fasta")
+        if self.aligner == 'blat' and not self.stream_fasta and not self.blat_cached:
+            os.remove(self.output_header + ".read_1.fasta")
+            os.remove(self.output_header + ".read_2.fasta")
     
+    @staticmethod
+    def readPSLGroups(input_file):
+        # BLAT writes every hit for a query on consecutive lines, so yield
+        # the split fields of each run of lines sharing a qName together
+        with open(input_file) as f:
+
+            # Go through BLAT header
+            for i in range(5):
+                next(f)
+
+            qName = None
+            group = []
+            for line in f:
+                fields = line.strip().split()
+                if fields[9] != qName:
+                    if group:
+                        yield qName, group
+                    qName = fields[9]
+                    group = []
+                group.append(fields)
+
+            if group:
+                yield qName, group
+
     def readAlignments(self, input_read_1_file, input_read_2_file):
-        
-        def readFile(input_file, read, add_if_present=False):
-            with open(input_file) as f:
-                
-                # Go through BLAT header
-                for i in range(5):
-                    next(f)
-                    
-                # Iterate through lines
-                for line in f:
-    
-                    [
-                        matches,
-                        misMatches,
-                        repMatches,
-                        nCount,
-                        qNumInsert,
-                        qBaseInsert,
-                        tNumInsert,
-                        tBaseInsert,
-                        strand,
-                        qName,
-                        qSize,
-                        qStart,
-                        qEnd,
-                        tName,
-                        tSize,
-                        tStart,
-                        tEnd,
-                        blockCount,
-                        blockSizes,
-                        qStarts,
-                        tStarts,
-                    ] = line.strip().split()
-                    
-                    qStarts = qStarts.split(",")[:-1]
-                    tStarts = tStarts.split(",")[:-1]
-                    blockSizes = blockSizes.split(",")[:-1]
-                    
-                    q_list = []
-                    t_list = []
-                    
-                    if (len(blockSizes) > 1) or (add_if_present and qName in self.alignment):
-                        
-                        if qName not in self.alignment:
-                            self.alignment[qName] = {'read_1': [], 'read_2': []}
-                        
-                        for q, t, size in zip(qStarts, tStarts, blockSizes):
-                            if strand == "+":
-                                q = [
-                                    int(q) + 1,
-                                    int(q) + int(size),
-                                ]
-                            if strand == "-":
-                                q = [
-                                    int(qSize) - int(q) - int(size) + 1,
-                                    int(qSize) - int(q),
-                                ]
-                            
-                            t = [
-                                int(t) + 1,
-                                int(t) + int(size),
-                            ]
-        
-                            for i, value in enumerate(t):
-                                if value > self.ref_seq_length:
-                                    t[i] = value - self.ref_seq_length
-                            
-                            q_list.append(q)
-                            t_list.append(t)
-                        
-                        mapped_regions = []
-                        for q, t in zip(q_list, t_list):
-                            mapped_regions.append({
-                                'q': q,
-                                't': t,
-                            })
-                        
-                        read_dict = {
-                            'mapped_regions': mapped_regions,
-                            'strand': strand,
-                            'matches': int(matches),
-                            'tGap': int(tNumInsert),
-                            'qGap': int(qNumInsert),
-                        }
-                        
-                        if read_dict not in self.alignment[qName][read]:
-                            self.alignment[qName][read].append({
-                                'mapped_regions': mapped_regions,
-                                'strand': strand,
-                                'matches': int(matches),
-                                'tGap': int(tNumInsert),
-                                'qGap': int(qNumInsert),
-                            })
-
-        readFile(input_read_1_file, 'read_1')
-        readFile(input_read_2_file, 'read_2')
-        readFile(input_read_1_file, 'read_1', add_if_present=True)
-        readFile(input_read_2_file, 'read_2', add_if_present=True)
+
+        def parseAlignment(fields):
+            [
+                matches,
+                misMatches,
+                repMatches,
+                nCount,
+                qNumInsert,
+                qBaseInsert,
+                tNumInsert,
+                tBaseInsert,
+                strand,
+                qName,
+                qSize,
+                qStart,
+                qEnd,
+                tName,
+                tSize,
+                tStart,
+                tEnd,
+                blockCount,
+                blockSizes,
+                qStarts,
+                tStarts,
+            ] = fields
+
+            qStarts = qStarts.split(",")[:-1]
+            tStarts = tStarts.split(",")[:-1]
+            blockSizes = blockSizes.split(",")[:-1]
+
+            blocks = []
+            for q, t, size in zip(qStarts, tStarts, blockSizes):
+                if strand == "+":
+                    q = [
+                        int(q) + 1,
+                        int(q) + int(size),
+                    ]
+                if strand == "-":
+                    q = [
+                        int(qSize) - int(q) - int(size) + 1,
+                        int(qSize) - int(q),
+                    ]
+
+                t = [
+                    int(t) + 1,
+                    int(t) + int(size),
+                ]
+
+                for i, value in enumerate(t):
+                    if value > self.ref_seq_length:
+                        t[i] = value - self.ref_seq_length
+
+                blocks.append((q[0], q[1], t[0], t[1]))
+
+            # Hashable, so the parsed alignment doubles as its dedup key
+            return (
+                strand,
+                int(matches),
+                int(tNumInsert),
+                int(qNumInsert),
+                tuple(blocks),
+            )
+
+        def isSplit(fields):
+            return len(fields[18].split(",")[:-1]) > 1
+
+        def addQuery(qName, groups):
+            self.psl_stats['queries'] += 1
+            self.psl_stats['lines'] += sum(len(group) for group in groups.values())
+
+            if self.aligned_base_counter is not None:
+                blocks = set()
+                for group in groups.values():
+                    for fields in group:
+                        for start, size in zip(fields[20].split(",")[:-1], fields[18].split(",")[:-1]):
+                            blocks.add((int(start) + 1, int(start) + int(size)))
+                self.aligned_base_counter.addRead(blocks, self.pair_copies.get(qName, 1))
+
+            # Keep every alignment of both mates once either mate is split
+            if qName not in self.alignment:
+                if not any(isSplit(fields) for group in groups.values() for fields in group):
+                    return
+                self.alignment.addRead(qName)
+
+            for read, group in groups.items():
+                keys = set(
+                    self.alignment.key(index)
+                    for index in self.alignment.alignments(qName, read)
+                )
+                lines = set()
+
+                for fields in group:
+
+                    # Skip repeated PSL lines before parsing them
+                    line = tuple(fields)
+                    if line in lines:
+                        continue
+                    lines.add(line)
+
+                    alignment = parseAlignment(fields)
+                    if alignment not in keys:
+                        keys.add(alignment)
+                        self.alignment.add(qName, read, *alignment)
+
+        self.psl_stats = {'queries': 0, 'lines': 0}
+
+        # Both PSLs list queries in the order of the paired FASTQ files, so
+        # walk them in lockstep and only buffer queries still waiting on the
+        # other mate's file. The buffer stays small only while both files
+        # keep that order; queries out of order are still paired, but wait
+        # in the buffer until their mate turns up or the files end. Once
+        # one file ends, queries of the other have nothing left to wait for.
+        mates = {'read_1': 'read_2', 'read_2': 'read_1'}
+        readers = {
+            'read_1': self.readPSLGroups(input_read_1_file),
+            'read_2': self.readPSLGroups(input_read_2_file),
+        }
+        pending = {'read_1': OrderedDict(), 'read_2': OrderedDict()}
+        max_pending = 0
+
+        while readers:
+            for read in ['read_1', 'read_2']:
+                if read not in readers:
+                    continue
+                try:
+                    qName, group = next(readers[read])
+                except StopIteration:
+                    del readers[read]
+                    for name, other_group in pending[mates[read]].items():
+                        addQuery(name, {mates[read]: other_group})
+                    pending[mates[read]].clear()
+                    continue
+
+                other = mates[read]
+                if qName in pending[other]:
+
+                    # Queries buffered ahead of qName have no hits in this file
+                    while True:
+                        name, other_group = pending[other].popitem(last=False)
+                        if name == qName:
+                            break
+                        addQuery(name, {other: other_group})
+
+                    # Queries buffered behind qName have no hits in the other file
+                    for name, own_group in pending[read].items():
+                        addQuery(name, {read: own_group})
+                    pending[read].clear()
+
+                    addQuery(qName, {read: group, other: other_group})
+                elif other not in readers:
+                    addQuery(qName, {read: group})
+                else:
+
+                    # A qName repeated further down its file joins its earlier hits
+                    pending[read].setdefault(qName, []).extend(group)
+
+                max_pending = max(max_pending, len(pending['read_1']) + len(pending['read_2']))
+
+        for read in ['read_1', 'read_2']:
+            for name, group in pending[read].items():
+                addQuery(name, {read: group})
+
+        self.psl_stats.update({
+            'max_buffered_queries': max_pending,
+            'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        })
 
     def findBreaks(self):
-        for query in self.alignment:
-            for read, alignments in self.alignment[query].items():
+        store = self.alignment
+        if not len(store):
+            return
+
+        blocks = store.blockTable()
+
+        # Order blocks by alignment, then by q start in read order (reversed
+        # on the minus strand), so adjacent rows are adjacent split blocks
+        order = numpy.lexsort((
+            blocks['q_start'] * blocks['strand'],
+            blocks['alignment'],
+        ))
+        alignment = blocks['alignment'][order]
+        sizes = numpy.abs(blocks['q_end'][order] - blocks['q_start'][order]) + 1
+        long_enough = sizes >= self.required_alignment_length
+
+        adjacent = numpy.flatnonzero(
+            (alignment[:-1] == alignment[1:]) &
+            long_enough[:-1] &
+            long_enough[1:]
+        )
+
+        for index, start, end in zip(
+            alignment[adjacent].tolist(),
+            blocks['t_end'][order][adjacent].tolist(),
+            blocks['t_start'][order][adjacent + 1].tolist(),
+        ):
+            query = store.query(index)
+            read = store.read(index)
+
+            if query not in self.breakpoints:
+                self.breakpoints[query] = {'read_1': set(), 'read_2': set()}
+
+            self.breakpoints[query][read].add((start, end))
+
+    def findBreaksByRead(self):
+        # Per-alignment reference implementation of findBreaks
+        store = self.alignment
+
+        for index in range(len(store)):
+            query = store.query(index)
+            read = store.read(index)
+
+            sorted_blocks = store.sortedBlocks(index)
+
+            for i in range(len(sorted_blocks)-1):
+                block_1 = sorted_blocks[i]
+                block_2 = sorted_blocks[i+1]
+
+                size_1 = abs(store.q_ends[block_1] - store.q_starts[block_1]) + 1
+                size_2 = abs(store.q_ends[block_2] - store.q_starts[block_2]) + 1
+
+                if size_1 >= self.required_alignment_length and \
+                        size_2 >= self.required_alignment_length:
+
+                    if query not in self.breakpoints:
+                        self.breakpoints[query] = {'read_1': set(), 'read_2': set()}
+
+                    self.breakpoints[query][read].add((store.t_ends[block_1], store.t_starts[block_2]))
 
-                for alignment in alignments:
-                    
-                    strand = alignment['strand']
-                
-                    if strand == '+':
-                        sorted_alignments = sorted(alignment['mapped_regions'], key=lambda k: k['q'][0])
-                    if strand == '-':
-                        sorted_alignments = sorted(alignment['mapped_regions'], key=lambda k: k['q'][0], reverse = True)
-                        
-                    for i in range(len(sorted_alignments)-1):
-                        
-                        size_1 = abs(sorted_alignments[i]['q'][1] - sorted_alignments[i]['q'][0]) + 1
-                        size_2 = abs(sorted_alignments[i+1]['q'][1] - sorted_alignments[i+1]['q'][0]) + 1
-                        
-                        if size_1 >= self.required_alignment_length and \
-                                size_2 >= self.required_alignment_length:
-                            
-                            if query not in self.breakpoints:
-                                self.breakpoints[query] = {'read_1': set(), 'read_2': set()}
-                            
-                            self.breakpoints[query][read].add((sorted_alignments[i]['t'][1], sorted_alignments[i+1]['t'][0]))
-                            
     def compareBreaksAcrossReads(self, ref_seq):
         
         def leftAlign(breakpoints):
             output_breakpoints = {'read_1': set(), 'read_2': set()}
-            padded_seq = ref_seq + ref_seq
-            
-            for read, breakpoint_list in breakpoints.items():
 
+            for read, breakpoint_list in breakpoints.items():
                 for breakpoint in breakpoint_list:
-                    breakpoint = list(breakpoint)
-                    
-                    if breakpoint[1] < breakpoint[0]:
-                        breakpoint[1] += self.ref_seq_length
-                    
-                    repeat = True
-                    while repeat:
-                        repeat = False
-                        
-                        del_seq = padded_seq[breakpoint[0]:breakpoint[1]-1]
-                        
-                        index = 1
-                        while index <= len(del_seq):
-                            if del_seq[-index:] == padded_seq[breakpoint[0]-index:breakpoint[0]]:
-                                breakpoint[0] -= index
-                                breakpoint[1] -= index
-                                repeat = True
-                                break
-                            index += 1
-                    
-                    if breakpoint[1] > self.ref_seq_length:
-                        breakpoint[1] -= self.ref_seq_length
-
-                    output_breakpoints[read].add(tuple(breakpoint))
-            
+                    output_breakpoints[read].add(reference_index.leftAlign(breakpoint))
+
             return output_breakpoints
         
         def findNestedDeletions(breakpoints):
@@ -261,18 +501,22 @@ class ROTLA(object):
                 for breakpoint in breakpoint_list:
                     breaklist.append([read, breakpoint[0], breakpoint[1]])
 
-            repeat = True
-            while repeat:
-                repeat = False
-                aligned_breaklist = copy.copy(breaklist)
-                
-                for i, break_1 in enumerate(breaklist):
-                    for j, break_2 in enumerate(breaklist):
-                        if break_1 != break_2 and break_1[1] >= break_2[1] and break_1[2] <= break_2[2] and (break_1[1] != break_2[1] or break_1[2] != break_2[2]):
-                            aligned_breaklist[j] = [break_2[0], break_1[1], break_1[2]]
-                            repeat = True
-                
-                breaklist = aligned_breaklist
+            # Each pass moves every breakpoint onto the last listed breakpoint
+            # nested inside it, until none contains another. This takes
+            # repeated passes rather than one sorted pass: a pass looks at
+            # where the other breakpoints were moved by the pass before, so
+            # the end point of a breakpoint is not just the end point of the
+            # last breakpoint nested in it. Every pass is one O(n log n)
+            # lookup, and reads with many hits take three or four.
+            while True:
+                contained = last_contained([(break_2[1], break_2[2]) for break_2 in breaklist])
+                if all(i == -1 for i in contained):
+                    break
+
+                breaklist = [
+                    [breaklist[j][0], breaklist[i][1], breaklist[i][2]] if i != -1 else breaklist[j]
+                    for j, i in enumerate(contained)
+                ]
             
             for breakpoint in breaklist:
                 output_breakpoints[breakpoint[0]].add((breakpoint[1], breakpoint[2]))
@@ -281,55 +525,46 @@ class ROTLA(object):
         
         def removeConflictingDeletions(query, breakpoints):
             
-            def overlapsOther(breakpoint, query, break_read):
-                if break_read == 'read_1':
-                    read = 'read_2'
-                if break_read == 'read_2':
-                    read = 'read_1'
-                
-                for alignment in self.alignment[query][read]:
-                    strand = alignment['strand']
-                    mapped_regions = alignment['mapped_regions']
-                    
-                    if strand == '+':
-                        sorted_regions = sorted(mapped_regions, key=lambda k: k['q'][0])
-                    if strand == '-':
-                        sorted_regions = sorted(mapped_regions, key=lambda k: k['q'][0], reverse = True)
-                    
-                    t_range = [(sorted_regions[0]['t'][0], sorted_regions[-1]['t'][1])]
-
-                    if t_range[0][0] > t_range[0][1]:
-                        t_range = [(1, t_range[0][1]), (t_range[0][0], self.ref_seq_length)]
-                    
-                    for _range in t_range:
-                        if breakpoint[0] >= _range[0] and breakpoint[0] <= _range[1] and \
-                            breakpoint[1] >= _range[0] and breakpoint[1] <= _range[1]:
-                                return True
+            def overlapsOther(breakpoint, t_ranges):
+                for _range in t_ranges:
+                    if breakpoint[0] >= _range[0] and breakpoint[0] <= _range[1] and \
+                        breakpoint[1] >= _range[0] and breakpoint[1] <= _range[1]:
+                            return True
                 
                 return False
             
-            output_breakpoints = {'read_1': set(), 'read_2': set()}
+            # Reference ranges spanned by the alignments of each mate, and
+            # every breakpoint keyed by its read
+            store = self.alignment
+            t_ranges = dict()
+            for read in ['read_1', 'read_2']:
+                t_ranges[read] = []
+                for index in store.alignments(query, read):
+                    t_ranges[read].extend(store.targetRanges(index, self.ref_seq_length))
             
             breaklist = []
             for read, breakpoint_list in breakpoints.items():
                 for breakpoint in breakpoint_list:
-                    breaklist.append([read, breakpoint[0], breakpoint[1]])
-            cleaned_breaklist = copy.copy(breaklist)
-            
-            for break_1 in breaklist:
-                if overlapsOther((break_1[1], break_1[2]), query, break_1[0]):
-                    other_read = False
-                    for break_2 in breaklist:
-                        if break_1[0] != break_2[0] and break_1[1] == break_2[1] and break_1[2] == break_2[2]:
-                            other_read = True
-                    if not other_read:
-                        cleaned_breaklist.remove(break_1)
+                    breaklist.append((read, breakpoint[0], breakpoint[1]))
+            breakset = set(breaklist)
             
-            for breakpoint in cleaned_breaklist:
-                output_breakpoints[breakpoint[0]].add((breakpoint[1], breakpoint[2]))
+            # A breakpoint inside the span of an alignment of the other mate
+            # is dropped unless the other mate has it too
+            output_breakpoints = {'read_1': set(), 'read_2': set()}
+            mates = {'read_1': 'read_2', 'read_2': 'read_1'}
+            for read, breakpoint_0, breakpoint_1 in breaklist:
+                other = mates[read]
+                if overlapsOther((breakpoint_0, breakpoint_1), t_ranges[other]) and \
+                        (other, breakpoint_0, breakpoint_1) not in breakset:
+                    continue
+                output_breakpoints[read].add((breakpoint_0, breakpoint_1))
             
             return output_breakpoints
         
+        if self.reference_index is None:
+            self.reference_index = ReferenceIndex(ref_seq)
+        reference_index = self.reference_index
+
         for query in self.breakpoints:
             breakpoints = copy.copy(self.breakpoints[query])
             
@@ -340,7 +575,8 @@ class ROTLA(object):
             self.breakpoints[query] = breakpoints
     
     def compileBreaks(self):
-        
+        # A collapsed pair supports its breakpoints once per copy, and once
+        # in the unique counts
         for query in self.breakpoints:
             break_set = set()
             
@@ -348,27 +584,83 @@ class ROTLA(object):
                 for breakpoint in breakpoint_list:
                     break_set.add(tuple(breakpoint))
         
+            copies = self.pair_copies.get(query, 1)
             for breakpoint in break_set:
-                self.break_count[breakpoint] += 1
+                self.break_count[breakpoint] += copies
+                if self.unique_break_count is not None:
+                    self.unique_break_count[breakpoint] += 1
     
+    def findBreaksInParallel(self, ref_seq):
+        # Reads are independent until their breakpoints are counted, so run
+        # findBreaks through compileBreaks on shards of reads in a process
+        # pool and sum the per-shard counts
+        pool = Pool(self.threads, initShardWorker, (ref_seq, self.reference_index))
+
+        try:
+            shards = (
+                (shard, self.required_alignment_length, self.shardCopies(shard))
+                for shard in self.alignment.shards(SHARD_SIZE)
+            )
+            for break_count, unique_break_count in pool.imap(findShardBreaks, shards):
+                for breakpoint, count in break_count.items():
+                    self.break_count[breakpoint] += count
+                if unique_break_count is not None:
+                    for breakpoint, count in unique_break_count.items():
+                        self.unique_break_count[breakpoint] += count
+        finally:
+            pool.close()
+            pool.join()
+
+    def shardCopies(self, shard):
+        # Copies of the collapsed pairs in a shard, or None if pairs were
+        # not collapsed
+        if self.unique_break_count is None:
+            return None
+        return dict(
+            (query, self.pair_copies[query])
+            for query in shard.read_names if query in self.pair_copies
+        )
+
     def compareAcrossAllBreaks(self, ref_seq):
+
+        # A breakpoint can only be another shifted right through a direct
+        # repeat if it has the same span and starts inside it. Candidates
+        # come ordered by shift, so stop at the first repeat mismatch.
+        break_list = self.break_count.keys()
+        shifted = dict()
+        for break_1, candidates in zip(break_list, shifted_overlaps(break_list)):
+            shifted[break_1] = []
+            for index in candidates:
+                break_2 = break_list[index]
+                offset_1 = ref_seq[break_1[0]:break_2[0]]
+                offset_2 = ref_seq[break_1[1]-1:break_2[1]-1]
+                if offset_1 != offset_2:
+                    break
+                shifted[break_1].append(break_2)
         
+        # Walk breakpoints in sorted order so merges do not depend on how
+        # the counts were accumulated. Merges depend only on which
+        # breakpoints there are, so unique counts are merged alongside.
+        count_tables = [self.break_count]
+        if self.unique_break_count is not None:
+            count_tables.append(self.unique_break_count)
+        self.merge_stats = {'passes': 0, 'merges': 0}
         repeat = True
         while repeat:
             repeat = False
+            self.merge_stats['passes'] += 1
             
-            for break_1 in self.break_count.keys():
-                for break_2 in self.break_count.keys():
-                    if break_1 != break_2 and break_1[0] < break_2[0] and break_1[1] > break_2[0] and break_1[1] < break_2[1]:
-                        offset_1 = ref_seq[break_1[0]:break_2[0]]
-                        offset_2 = ref_seq[break_1[1]-1:break_2[1]-1]
-                        if offset_1 == offset_2:
-                            self.break_count[break_1] += self.break_count[break_2]
-                            self.break_count.pop(break_2, None)
-
-                            repeat = True
+            for break_1 in sorted(self.break_count.keys()):
+                for break_2 in shifted[break_1]:
+                    if break_2 in self.break_count:
+                        for break_count in count_tables:
+                            break_count[break_1] += break_count[break_2]
+                            break_count.pop(break_2, None)
+                        self.merge_stats['merges'] += 1
+
+                        repeat = True
     
-    def printBreaks(self):
+    def printBreaks(self, break_count, output_file):
         
         def checkBreakPosition(position):
             if position == 0:
@@ -378,46 +670,357 @@ class ROTLA(object):
             return position
         
         break_list = []
-        for breakpoint, count in self.break_count.items():
+        for breakpoint, count in break_count.items():
             if breakpoint[0]+1 != breakpoint[1]:
                 start = checkBreakPosition(breakpoint[0]+1)
                 end = checkBreakPosition(breakpoint[1]-1)
                 break_list.append([start, end, count])
         
-        with open(self.output_header + ".breakpoints.txt", "w") as OUTPUT:
+        with open_output(output_file) as OUTPUT:
             OUTPUT.write('Start\tEnd\tCount\n')
-            for breakpoint in sorted(break_list, key=lambda k: (int(k[0]), int(k[1]), -int(k[2]))):
-                OUTPUT.write(str(breakpoint[0]) + '\t' + str(breakpoint[1]) + "\t" + str(breakpoint[2]) + "\n")
+            write_lines(OUTPUT, (
+                '{}\t{}\t{}\n'.format(*breakpoint)
+                for breakpoint in sorted(break_list, key=lambda k: (int(k[0]), int(k[1]), -int(k[2])))
+            ))
     
-    def execute(self):
+    def findAllBreaks(self, ref_seq):
+
+        if self.threads > 1:
+            with self.metrics.stage('find_breaks_parallel'):
+                self.findBreaksInParallel(ref_seq)
+        else:
+            with self.metrics.stage('find_breaks'):
+                self.findBreaks()
+            with self.metrics.stage('compare_breaks_across_reads'):
+                self.compareBreaksAcrossReads(ref_seq)
+            with self.metrics.stage('compile_breaks'):
+                self.compileBreaks()
+        self.metrics.count('raw_breakpoints', len(self.break_count))
+
+        with self.metrics.stage('compare_across_all_breaks'):
+            self.compareAcrossAllBreaks(ref_seq)
+        self.metrics.count('normalized_breakpoints', len(self.break_count))
+        self.metrics.count('merge_passes', self.merge_stats['passes'])
+        self.metrics.count('merges', self.merge_stats['merges'])
+
+        with self.metrics.stage('print_breaks'):
+            self.printBreaks(self.break_count, self.output_header + ".breakpoints.txt")
+            if self.unique_break_count is not None:
+                self.printBreaks(self.unique_break_count, self.output_header + ".unique_breakpoints.txt")
+
+    def countAlignments(self):
+        for key in ['queries', 'lines', 'max_buffered_queries']:
+            self.metrics.count('psl_' + key, self.psl_stats[key])
+        self.metrics.count('split_reads', len(self.alignment.read_names))
+        self.metrics.count('split_alignments', len(self.alignment))
+
+    def alignReads(self, padded_fn, ref_seq):
+
+        if self.prescreen and self.kmer_index is None:
+            with self.metrics.stage('prescreen_index'):
+                self.kmer_index = KmerIndex(ref_seq)
+
+        getattr(self, self.ALIGNERS[self.aligner])(padded_fn, ref_seq)
+
+        self.metrics.count('read_pairs', self.prescreen_stats['pairs'])
+        self.metrics.count('read_pairs_aligned', self.pairs_written)
+        if self.prescreen:
+            self.metrics.count('prescreen_skipped_pairs', self.prescreen_stats['skipped_pairs'])
+            self.printPrescreenStats()
+        if self.collapse_duplicates:
+            self.metrics.count('unique_pairs', self.duplicate_stats['unique_pairs'])
+            self.printDuplicates()
+
+    def alignWithBLAT(self, padded_fn, ref_seq):
+        
+        # Make FASTA files from DNA-seq, or stream them straight to BLAT
+        if self.stream_fasta:
+            fasta_writer = self.writeFASTA
+        else:
+            fasta_writer = None
+            with self.metrics.stage('write_fasta'), \
+                    open(self.output_header + ".read_1.fasta", "w") as fasta_1, \
+                    open(self.output_header + ".read_2.fasta", "w") as fasta_2:
+                self.writeFASTA([[fasta_1], [fasta_2]])
+        
+        # Perform alignments; when streaming, this includes writing FASTA
+        with self.metrics.stage('blat', profile=False):
+            run_blat(
+                self.blat_path,
+                padded_fn,
+                [self.output_header + ".read_1.fasta", self.output_header + ".read_2.fasta"],
+                [self.output_header + ".read_1.psl", self.output_header + ".read_2.psl"],
+                [self.output_header + ".read_1.blat.out", self.output_header + ".read_2.blat.out"],
+                chunks=self.blat_chunks,
+                jobs=self.blat_jobs,
+                writer=fasta_writer,
+            )
+
+    def alignWithKmers(self, padded_fn, ref_seq):
+        # Align pairs straight from the FASTQ files with the built-in
+        # aligner, ALIGN_BATCH_SIZE pairs at a time, in self.threads
+        # processes. No FASTA files are written and no BLAT is run.
+        if self.kmer_aligner is None:
+            with self.metrics.stage('kmer_aligner_index'):
+                self.kmer_aligner = KmerAligner(ref_seq)
+
+        def pairBatches():
+            batch = []
+            for records in self.readPairs():
+                batch.append(records)
+                self.pairs_written += 1
+                if len(batch) == ALIGN_BATCH_SIZE:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+        pool = None
+        with self.metrics.stage('kmer_align'), \
+                open(self.output_header + ".read_1.psl", "w") as psl_1, \
+                open(self.output_header + ".read_2.psl", "w") as psl_2:
+            psl_1.write(PSL_HEADER)
+            psl_2.write(PSL_HEADER)
+
+            if self.threads > 1:
+                pool = Pool(self.threads, init_align_worker, (self.kmer_aligner,))
+                results = pool.imap(align_batch, pairBatches())
+            else:
+                init_align_worker(self.kmer_aligner)
+                results = (align_batch(batch) for batch in pairBatches())
+
+            try:
+                for psl_text_1, psl_text_2 in results:
+                    psl_1.write(psl_text_1)
+                    psl_2.write(psl_text_2)
+            finally:
+                if pool:
+                    pool.close()
+                    pool.join()
+
+    def alignReadsThroughCache(self, padded_fn, ref_seq):
+        # BLAT output depends only on the reads, the padded reference, the
+        # BLAT binary (or which built-in aligner stands in for it) and which
+        # pairs the prescreen holds back; chunking and streaming do not
+        # change it
+        cache = BlatCache(self.blat_cache, int(self.blat_cache_size * 1024 ** 3))
+        options = ['prescreen', self.prescreen_mismatches] if self.prescreen else []
+        if self.collapse_duplicates:
+            options.append('collapse_duplicates')
+        input_files = [self.read_1_fn, self.read_2_fn, padded_fn]
+        extensions = ['.psl']
+        if self.aligner == 'blat':
+            input_files.append(self.blat_path)
+            extensions.append('.blat.out')
+        else:
+            options.extend(['aligner', self.aligner])
+        with self.metrics.stage('blat_cache_key'):
+            key = cache.key(input_files, options)
+
+        cached_files = dict()
+        for read in ['read_1', 'read_2']:
+            for extension in extensions:
+                cached_files[read + extension] = self.output_header + "." + read + extension
+        if self.prescreen:
+            cached_files['prescreen.txt'] = self.output_header + ".prescreen.txt"
+        if self.collapse_duplicates:
+            for name in ['pair_copies.txt', 'duplicates.txt']:
+                cached_files[name] = self.output_header + "." + name
+
+        evicted = 0
+        with self.metrics.stage('blat_cache_fetch'):
+            self.blat_cached = cache.fetch(key, cached_files)
+        if self.blat_cached:
+            if self.prescreen:
+                self.readPrescreenStats()
+            if self.collapse_duplicates:
+                self.readDuplicates()
+        else:
+            self.alignReads(padded_fn, ref_seq)
+            with self.metrics.stage('blat_cache_store'):
+                evicted = cache.store(key, cached_files)
+        self.metrics.count('blat_cache_hit', int(self.blat_cached))
+
+        with open(self.output_header + ".blat_cache.txt", "w") as OUTPUT:
+            OUTPUT.write('{}\t{}\n'.format('key', key))
+            OUTPUT.write('{}\t{}\n'.format('hits', int(self.blat_cached)))
+            OUTPUT.write('{}\t{}\n'.format('misses', int(not self.blat_cached)))
+            OUTPUT.write('{}\t{}\n'.format('evicted_entries', evicted))
+
+    def prepareReference(self):
         
-        # Make FASTA files from DNA-seq
-        self.makeFASTA(self.read_1_fn, self.output_header + ".read_1.fasta")
-        self.makeFASTA(self.read_2_fn, self.output_header + ".read_2.fasta")
+        # Read in reference, from its saved index if current
+        self.reference = Reference.load(self.ref_fn, self.contig)
+        self.reference_index = self.reference.reference_index
         
         # Make padded reference
         padded_fn = self.output_header + ".padded_reference.fasta"
-        self.makePaddedFASTA(self.ref_fn, padded_fn)
+        self.reference.writePaddedFASTA(padded_fn)
+
+        return padded_fn, self.reference.sequence
+
+    def findBLAT(self):
+        # Path of the BLAT binary, looked up on PATH when paths.cfg gives a
+        # bare name
+        blat_path = find_executable(self.blat_path)
+        if blat_path is None:
+            raise StandardError(
+                'BLAT executable {} not found; set its path in paths.cfg.'.format(self.blat_path))
+
+        return blat_path
+
+    def execute(self):
         
-        # Read in reference
-        ref_seq = self.readReference(self.ref_fn).upper()
+        # The BLAT cache key hashes the BLAT binary, so find it before any
+        # output is written
+        if self.blat_cache and self.aligner == 'blat':
+            self.blat_path = self.findBLAT()
+
+        with self.metrics.stage('prepare_reference'):
+            padded_fn, ref_seq = self.prepareReference()
         self.ref_seq_length = len(ref_seq)
+
+        # Perform alignments, or reuse earlier BLAT results of the same reads
+        if self.blat_cache:
+            self.alignReadsThroughCache(padded_fn, ref_seq)
+        else:
+            self.alignReads(padded_fn, ref_seq)
         
-        # Perform alignments
-        with open(self.output_header + ".read_1.blat.out", "w") as blat_out:
-            call([self.blat_path, padded_fn, self.output_header + ".read_1.fasta", self.output_header + ".read_1.psl"], stdout=blat_out)
-        with open(self.output_header + ".read_2.blat.out", "w") as blat_out:
-            call([self.blat_path, padded_fn, self.output_header + ".read_2.fasta", self.output_header + ".read_2.psl"], stdout=blat_out)
-        
-        # Read alignments
-        self.readAlignments(self.output_header + ".read_1.psl", self.output_header + ".read_2.psl")
-
-        self.findBreaks()
-        self.compareBreaksAcrossReads(ref_seq)
-        self.compileBreaks()
-        self.compareAcrossAllBreaks(ref_seq)
-        self.printBreaks()
+        # Read alignments, counting aligned bases on the way if requested
+        with self.metrics.stage('read_alignments'):
+            if self.aligned_bases:
+                self.aligned_base_counter = AlignedBaseCounter(self.ref_seq_length)
+            self.readAlignments(self.output_header + ".read_1.psl", self.output_header + ".read_2.psl")
+            if self.aligned_bases:
+                print_aligned_bases(
+                    self.output_header,
+                    self.aligned_base_counter.total() + self.prescreen_stats['skipped_aligned_bases'],
+                )
+                if self.collapse_duplicates:
+                    print_aligned_bases(
+                        self.output_header,
+                        self.aligned_base_counter.uniqueTotal() +
+                        self.duplicate_stats['unique_skipped_aligned_bases'],
+                        '.unique_aligned_bases.txt',
+                    )
+        self.countAlignments()
+
+        if self.alignment_cache:
+            with self.metrics.stage('save_alignment_cache'):
+                psl_files = [self.output_header + ".read_1.psl", self.output_header + ".read_2.psl"]
+                self.alignment.save(
+                    self.output_header + ".alignments",
+                    input_key(psl_files, [self.reference.checksum]),
+                )
+
+        self.findAllBreaks(ref_seq)
         self.cleanFASTA()
+        self.metrics.write(self.output_header + ".metrics.json")
+
+class RescanROTLA(ROTLA):
+    # Breakpoint detection rerun on the PSL files of an earlier
+    # find-breakpoints run, e.g. with another --length. Parsed alignments
+    # come from the run's alignment cache when it was built from the same
+    # PSL files and reference; otherwise the PSL files are parsed again and
+    # the cache is rewritten.
+
+    def __init__(self, **kwargs):
+
+        # Set instance variables
+        self.input_header = kwargs['input_prefix']
+        self.ref_fn = kwargs['reference_sequence']
+        self.contig = kwargs['contig']
+        self.output_header = kwargs['output_prefix']
+        self.required_alignment_length = kwargs['length']
+        self.threads = kwargs['threads']
+        self.profile = kwargs['profile']
+
+        self.metrics = Metrics(
+            'rescan-breakpoints',
+            self.output_header + ".profile" if self.profile else None,
+        )
+        self.alignment = AlignmentStore()
+        self.breakpoints = dict()
+        self.break_count = defaultdict(int)
+        self.reference_index = None
+        self.aligned_base_counter = None
+
+        # Read pairs collapsed by the earlier run keep their copies
+        self.pair_copies = dict()
+        self.unique_break_count = None
+        if os.path.exists(self.input_header + ".pair_copies.txt"):
+            self.pair_copies = read_pair_copies(self.input_header + ".pair_copies.txt")
+            self.unique_break_count = defaultdict(int)
+
+        self.execute()
+
+    def execute(self):
+
+        # Read in reference, from its saved index if current
+        with self.metrics.stage('prepare_reference'):
+            self.reference = Reference.load(self.ref_fn, self.contig)
+        self.reference_index = self.reference.reference_index
+        ref_seq = self.reference.sequence
+        self.ref_seq_length = len(ref_seq)
+
+        # Load alignments from the cache if it is current
+        psl_files = [self.input_header + ".read_1.psl", self.input_header + ".read_2.psl"]
+        cache_dir = self.input_header + ".alignments"
+        with self.metrics.stage('alignment_cache_key'):
+            key = input_key(psl_files, [self.reference.checksum])
+
+        with self.metrics.stage('load_alignment_cache'):
+            alignment = AlignmentStore.load(cache_dir, key)
+        self.metrics.count('alignment_cache_hit', int(alignment is not None))
+
+        if alignment is None:
+            with self.metrics.stage('read_alignments'):
+                self.readAlignments(*psl_files)
+            with self.metrics.stage('save_alignment_cache'):
+                self.alignment.save(cache_dir, key)
+            self.countAlignments()
+        else:
+            self.alignment = alignment
+            self.metrics.count('split_reads', len(self.alignment.read_names))
+            self.metrics.count('split_alignments', len(self.alignment))
+
+        self.findAllBreaks(ref_seq)
+        self.metrics.write(self.output_header + ".metrics.json")
+
+# Reads per work unit sent to the find-breakpoints process pool
+SHARD_SIZE = 5000
+
+# Read pairs written to one BLAT input in turn when streaming FASTA in chunks
+STREAM_BATCH_SIZE = 10000
+
+def initShardWorker(ref_seq, reference_index):
+    global shard_reference
+    shard_reference = (ref_seq, reference_index)
+
+def findShardBreaks(shard):
+    # Per-read steps of ROTLA.execute for one shard, in a pool worker.
+    # Returns the breakpoint counts, and the unique counts if copies of
+    # collapsed pairs are given.
+    alignment, required_alignment_length, pair_copies = shard
+    ref_seq, reference_index = shard_reference
+
+    rotla = ROTLA.__new__(ROTLA)
+    rotla.alignment = alignment
+    rotla.required_alignment_length = required_alignment_length
+    rotla.ref_seq_length = len(ref_seq)
+    rotla.reference_index = reference_index
+    rotla.breakpoints = dict()
+    rotla.break_count = defaultdict(int)
+    rotla.pair_copies = pair_copies or dict()
+    rotla.unique_break_count = defaultdict(int) if pair_copies is not None else None
+
+    rotla.findBreaks()
+    rotla.compareBreaksAcrossReads(ref_seq)
+    rotla.compileBreaks()
+
+    if rotla.unique_break_count is None:
+        return dict(rotla.break_count), None
+    return dict(rotla.break_count), dict(rotla.unique_break_count)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -426,7 +1029,21 @@ if __name__ == '__main__':
     parser.add_argument('read_2_file_name', type=str, help='Read 2 file')
     parser.add_argument('reference_sequence', type=str, help='Reference sequence in FASTA format')
     parser.add_argument('output_prefix', type=str, help='Prefix for output file name')
+    parser.add_argument('--contig', type=str, help='Name of the reference sequence to use from a FASTA holding several', default=None)
     parser.add_argument('--length', type=int, help='Minimum required alignment length', default=25)
+    parser.add_argument('--threads', type=int, help='Number of processes for breakpoint detection and the kmer aligner', default=1)
+    parser.add_argument('--blat-chunks', type=int, help='Number of pieces each read FASTA is split into for BLAT', default=1)
+    parser.add_argument('--blat-jobs', type=int, help='Maximum number of concurrent BLAT processes', default=2)
+    parser.add_argument('--stream-fasta', action='store_true', help='Stream reads to BLAT through named pipes instead of writing FASTA files')
+    parser.add_argument('--prescreen', action='store_true', help='Skip read pairs whose mates both align contiguously to the reference')
+    parser.add_argument('--prescreen-mismatches', type=int, help='Mismatches allowed in a contiguous prescreen match', default=0)
+    parser.add_argument('--aligned-bases', action='store_true', help='Also count aligned bases while reading the PSL files')
+    parser.add_argument('--alignment-cache', action='store_true', help='Save parsed split-read alignments for rescan-breakpoints')
+    parser.add_argument('--blat-cache', type=str, help='Directory of cached BLAT results to reuse and add to', default=None)
+    parser.add_argument('--blat-cache-size', type=float, help='Maximum size of the BLAT cache in GB', default=50)
+    parser.add_argument('--aligner', choices=sorted(ROTLA.ALIGNERS), help='Read aligner', default='blat')
+    parser.add_argument('--collapse-duplicates', action='store_true', help='Align each distinct read pair once, counting its copies')
+    parser.add_argument('--profile', action='store_true', help='Write cProfile stats of the Python stages')
     args = parser.parse_args()
 
     ROTLA(**vars(args))
@@ -11,7 +11,11 @@ import ConfigParser
 
 PATHS = dict()
 config = ConfigParser.ConfigParser()
-config.read(os.path.join(
-    os.path.dirname(os.path.abspath(__file__)), '../config', 'paths.cfg'))
+
+# Installed under config/, or at the top of a source checkout
+config.read([
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '../config', 'paths.cfg'),
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'paths.cfg'),
+])
 for key, value in config.items('paths'):
     PATHS[key] = value
@@ -1,16 +1,13 @@
+import os
 import sys
+from array import array
 from collections import defaultdict
 
+import numpy
 
-def count_ref_bases(ref):
+from metrics import Metrics
+from reference import Reference
 
-    total = 0
-    with open(ref) as f:
-        for line in f:
-            if line[0] != ">":
-                total += len(line.strip())
-
-    return total
 
 def read_blocks(input_file, blocks):
 
@@ -38,46 +35,237 @@ def read_blocks(input_file, blocks):
         return blocks
 
 
-def count_aligned_bases(block_dict, seq_length):
+def merge_intervals(read_ids, starts, ends):
+    # Split each read's [start, end] intervals into pieces that cover
+    # every base of their union exactly once, returning the read id, start
+    # and end of each piece. Intervals are offset by read so one sort by
+    # start orders every read's intervals, and a running maximum of ends
+    # gives the part of each interval not already covered.
+    read_ids = numpy.asarray(read_ids, dtype=numpy.int64)
+    starts = numpy.asarray(starts, dtype=numpy.int64)
+    ends = numpy.asarray(ends, dtype=numpy.int64)
+
+    keep = ends >= starts
+    read_ids, starts, ends = read_ids[keep], starts[keep], ends[keep]
+    if not len(starts):
+        return read_ids, starts, ends
+
+    lowest = starts.min()
+    offsets = read_ids * (ends.max() - lowest + 2) - lowest
+    starts = starts + offsets
+    ends = ends + offsets
+
+    order = numpy.argsort(starts, kind='mergesort')
+    read_ids = read_ids[order]
+    starts = starts[order]
+    ends = ends[order]
+    offsets = offsets[order]
+
+    covered_to = numpy.empty_like(ends)
+    covered_to[0] = starts[0] - 1
+    covered_to[1:] = numpy.maximum.accumulate(ends)[:-1]
+
+    starts = numpy.maximum(starts, covered_to + 1)
+    keep = ends >= starts
+
+    return read_ids[keep], starts[keep] - offsets[keep], ends[keep] - offsets[keep]
+
+
+def merged_length(read_ids, starts, ends):
+    # Total over reads of the bases covered by the union of each read's
+    # intervals
+    read_ids, starts, ends = merge_intervals(read_ids, starts, ends)
+    return int((ends - starts + 1).sum())
 
-    def check_overlap(region_1, region_2):
-        pass
 
-    total = 0
+def fold_block(block, seq_length):
+    # Move a block on the second copy of the padded reference back onto the
+    # first, splitting it at the origin if needed
 
-    for blocks in block_dict.values():
+    # Account for padded sequence
+    if block[0] <= seq_length and block[1] <= seq_length:
+        return [(block[0], block[1])]
+    if block[0] <= seq_length and block[1] > seq_length:
+        return [(block[0], seq_length), (1, block[1] - seq_length)]
+    if block[0] > seq_length and block[1] > seq_length:
+        return [(block[0] - seq_length, block[1] - seq_length)]
+    return []
 
-        # Account for padded sequence
-        _blocks = []
+
+def fold_blocks(block_dict, seq_length):
+    # Flatten folded blocks into read id, start and end lists
+
+    read_ids = []
+    starts = []
+    ends = []
+
+    for read_id, blocks in enumerate(block_dict.values()):
         for block in blocks:
-            if block[0] <= seq_length and block[1] <= seq_length:
-                _blocks.append(block)
-            if block[0] <= seq_length and block[1] > seq_length:
-                _blocks.append([block[0], seq_length])
-                _blocks.append([1, block[1] - seq_length])
-            if block[0] > seq_length and block[1] > seq_length:
-                _blocks.append([block[0] - seq_length, block[1] - seq_length])
-        blocks = _blocks
-
-        overlap = set()
+            for start, end in fold_block(block, seq_length):
+                read_ids.append(read_id)
+                starts.append(start)
+                ends.append(end)
+
+    return read_ids, starts, ends
+
+
+class AlignedBaseCounter(object):
+    # Aligned base count accumulated one read at a time, for callers that
+    # already see every block of a read together. Reads are merged in
+    # batches to keep memory bounded. A read standing for several collapsed
+    # copies adds its bases once per copy to the total, and once to the
+    # unique total.
+
+    def __init__(self, seq_length, batch_size=100000):
+        self.seq_length = seq_length
+        self.batch_size = batch_size
+        self.count = 0
+        self.unique_count = 0
+        self.reads = 0
+        self.read_ids = array('i')
+        self.starts = array('i')
+        self.ends = array('i')
+        self.copies = array('i')
+
+    def addRead(self, blocks, copies=1):
         for block in blocks:
-            overlap = overlap | set(range(block[0], block[1] + 1))
+            for start, end in fold_block(block, self.seq_length):
+                self.read_ids.append(self.reads)
+                self.starts.append(start)
+                self.ends.append(end)
+
+        self.copies.append(copies)
+        self.reads += 1
+        if self.reads >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        read_ids, starts, ends = merge_intervals(self.read_ids, self.starts, self.ends)
+        lengths = ends - starts + 1
+        self.count += int((lengths * numpy.asarray(self.copies, dtype=numpy.int64)[read_ids]).sum())
+        self.unique_count += int(lengths.sum())
+        self.reads = 0
+        self.read_ids = array('i')
+        self.starts = array('i')
+        self.ends = array('i')
+        self.copies = array('i')
+
+    def total(self):
+        self.flush()
+        return self.count
+
+    def uniqueTotal(self):
+        self.flush()
+        return self.unique_count
+
+
+def count_aligned_bases(block_dict, seq_length):
+
+    return merged_length(*fold_blocks(block_dict, seq_length))
+
+
+def coverage_depth(starts, ends, seq_length, weights=None):
+    # Per-position read depth from merged pieces, each counted weights[i]
+    # times if given, accumulated through a difference array; position 1 is
+    # index 0
+    starts = numpy.clip(starts, 1, seq_length + 1)
+    ends = numpy.clip(ends, 0, seq_length)
+    keep = ends >= starts
+    if weights is not None:
+        weights = weights[keep]
+
+    difference = numpy.bincount(starts[keep] - 1, weights, minlength=seq_length + 1) - \
+        numpy.bincount(ends[keep], weights, minlength=seq_length + 1)
+
+    return numpy.cumsum(difference[:seq_length]).astype(numpy.int64)
+
+
+def write_bedgraph(depth, chrom, output_file):
+    # One line per run of equal, non-zero depth, with 0-based half-open
+    # coordinates
+    changes = numpy.flatnonzero(numpy.diff(depth)) + 1
+    run_starts = numpy.concatenate(([0], changes))
+    run_ends = numpy.concatenate((changes, [len(depth)]))
+    keep = depth[run_starts] != 0
+
+    with open(output_file, 'w') as OUTPUT:
+        for start, end, value in zip(
+            run_starts[keep].tolist(),
+            run_ends[keep].tolist(),
+            depth[run_starts][keep].tolist(),
+        ):
+            OUTPUT.write('{}\t{}\t{}\t{}\n'.format(chrom, start, end, value))
+
+def read_pair_copies(file_name):
+    # Copies of each collapsed read pair, from the .pair_copies.txt file of
+    # a find_breakpoints run with --collapse-duplicates. Pairs not listed
+    # have one copy.
+    copies = dict()
+    with open(file_name) as f:
+        for line in f:
+            name, count = line.rstrip('\n').split('\t')
+            copies[name] = int(count)
+
+    return copies
+
+def read_stats(file_name, key):
+    # Value of key in a key and value file such as .prescreen.txt, or 0
+    if os.path.exists(file_name):
+        with open(file_name) as f:
+            for line in f:
+                name, value = line.strip().split('\t')
+                if name == key:
+                    return int(value)
+
+    return 0
+
+def get_aligned_bases(input_prefix, ref, coverage_format=None, contig=None):
+
+    metrics = Metrics('get-aligned-bases')
+
+    with metrics.stage('load_reference'):
+        reference = Reference.load(ref, contig)
+    ref_length = reference.length
+
+    # Read pairs collapsed by find_breakpoints count once per copy
+    collapsed = os.path.exists(input_prefix + '.pair_copies.txt')
+    copies = read_pair_copies(input_prefix + '.pair_copies.txt') if collapsed else dict()
 
-        total += len(overlap)
+    with metrics.stage('read_blocks'):
+        blocks = defaultdict(set)
+        blocks = read_blocks(input_prefix + '.read_1.psl', blocks)
+        blocks = read_blocks(input_prefix + '.read_2.psl', blocks)
+    metrics.count('reads', len(blocks))
 
-    return total
+    with metrics.stage('merge_intervals'):
+        read_ids, starts, ends = merge_intervals(*fold_blocks(blocks, ref_length))
+        weights = numpy.array([copies.get(name, 1) for name in blocks], dtype=numpy.int64)[read_ids]
+        unique_count = int((ends - starts + 1).sum())
+        count = int(((ends - starts + 1) * weights).sum())
+    metrics.count('merged_intervals', len(starts))
 
-def get_aligned_bases(input_prefix, ref):
+    if coverage_format:
+        with metrics.stage('coverage'):
+            depth = coverage_depth(starts, ends, ref_length, weights if collapsed else None)
+            if coverage_format == 'bedgraph':
+                write_bedgraph(depth, reference.name, input_prefix + '.coverage.bedGraph')
+            if coverage_format == 'npy':
+                numpy.save(input_prefix + '.coverage.npy', depth)
 
-    ref_length = count_ref_bases(ref)  
+    # Pairs skipped by the find_breakpoints prescreen never reached BLAT
+    count += read_stats(input_prefix + '.prescreen.txt', 'skipped_aligned_bases')
 
-    blocks = defaultdict(set)
-    blocks = read_blocks(input_prefix + '.read_1.psl', blocks)
-    blocks = read_blocks(input_prefix + '.read_2.psl', blocks)
+    print_aligned_bases(input_prefix, count)
+    metrics.count('aligned_bases', count)
+    if collapsed:
+        unique_count += read_stats(input_prefix + '.duplicates.txt', 'unique_skipped_aligned_bases')
+        print_aligned_bases(input_prefix, unique_count, '.unique_aligned_bases.txt')
+        metrics.count('unique_aligned_bases', unique_count)
+    metrics.write(input_prefix + '.aligned_bases.metrics.json')
 
-    count = count_aligned_bases(blocks, ref_length)
+def print_aligned_bases(input_prefix, count, extension='.aligned_bases.txt'):
 
-    with open(input_prefix + '.aligned_bases.txt', 'w') as OUTPUT:
+    with open(input_prefix + extension, 'w') as OUTPUT:
         OUTPUT.write('{}\t{}\n'.format(input_prefix,count))
 
 if __name__ == '__main__':
@@ -0,0 +1,314 @@
+import hashlib
+import os
+
+from array import array
+
+import numpy
+
+MATES = ['read_1', 'read_2']
+STRANDS = {'+': 1, '-': -1}
+
+# Typed columns written to an alignment cache, one .npy file each
+COLUMNS = [
+    ('heads', 'i'),
+    ('tails', 'i'),
+    ('read_ids', 'i'),
+    ('mates', 'b'),
+    ('strands', 'b'),
+    ('matches', 'i'),
+    ('t_gaps', 'i'),
+    ('q_gaps', 'i'),
+    ('block_offsets', 'i'),
+    ('block_counts', 'i'),
+    ('next_alignment', 'i'),
+    ('span_starts', 'i'),
+    ('span_ends', 'i'),
+    ('q_starts', 'i'),
+    ('q_ends', 'i'),
+    ('t_starts', 'i'),
+    ('t_ends', 'i'),
+]
+DTYPES = {'i': numpy.intc, 'b': numpy.int8}
+
+# Bump when the cache layout or the parsing that fills it changes
+CACHE_VERSION = 2
+
+
+# Bytes hashed at each end of an input file
+KEY_BLOCK_SIZE = 1 << 20
+
+
+def input_key(file_names, options=()):
+    # Hash identifying the files an alignment cache was built from, and
+    # anything else it depends on, such as the reference checksum. Rather
+    # than reading whole PSL files on every rescan, each file is keyed on
+    # its size, modification time and first and last blocks, which hold
+    # the header and the queries written last.
+    digest = hashlib.sha1('{}\n'.format(CACHE_VERSION))
+    for file_name in file_names:
+        status = os.stat(file_name)
+        digest.update('{}\t{!r}\n'.format(status.st_size, status.st_mtime))
+        with open(file_name, 'rb') as f:
+            digest.update(f.read(KEY_BLOCK_SIZE))
+            if status.st_size > KEY_BLOCK_SIZE:
+                f.seek(max(KEY_BLOCK_SIZE, status.st_size - KEY_BLOCK_SIZE))
+                digest.update(f.read(KEY_BLOCK_SIZE))
+        digest.update('\n')
+    for option in options:
+        digest.update('{}\n'.format(option))
+
+    return digest.hexdigest()
+
+
+class AlignmentStore(object):
+    # Split-read alignments held in parallel typed arrays instead of nested
+    # dicts and lists. Alignment i covers blocks block_offsets[i] to
+    # block_offsets[i] + block_counts[i] - 1, and the alignments of each
+    # read/mate are chained through next_alignment. span_starts[i] and
+    # span_ends[i] are the t start of its first block and the t end of its
+    # last block in read order.
+
+    __slots__ = [
+        'read_names',
+        'read_index',
+        'heads',
+        'tails',
+        'read_ids',
+        'mates',
+        'strands',
+        'matches',
+        't_gaps',
+        'q_gaps',
+        'block_offsets',
+        'block_counts',
+        'next_alignment',
+        'span_starts',
+        'span_ends',
+        'q_starts',
+        'q_ends',
+        't_starts',
+        't_ends',
+    ]
+
+    def __init__(self):
+
+        # Per read
+        self.read_names = []
+        self.read_index = dict()
+        self.heads = array('i')
+        self.tails = array('i')
+
+        # Per alignment
+        self.read_ids = array('i')
+        self.mates = array('b')
+        self.strands = array('b')
+        self.matches = array('i')
+        self.t_gaps = array('i')
+        self.q_gaps = array('i')
+        self.block_offsets = array('i')
+        self.block_counts = array('i')
+        self.next_alignment = array('i')
+        self.span_starts = array('i')
+        self.span_ends = array('i')
+
+        # Per block
+        self.q_starts = array('i')
+        self.q_ends = array('i')
+        self.t_starts = array('i')
+        self.t_ends = array('i')
+
+    def __getstate__(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def __len__(self):
+        return len(self.read_ids)
+
+    def __contains__(self, query):
+        return query in self.read_index
+
+    def addRead(self, query):
+        if query not in self.read_index:
+            query = intern(query)
+            self.read_index[query] = len(self.read_names)
+            self.read_names.append(query)
+            self.heads.extend([-1, -1])
+            self.tails.extend([-1, -1])
+
+        return self.read_index[query]
+
+    def add(self, query, read, strand, matches, t_gap, q_gap, blocks):
+        # blocks is a sequence of (q start, q end, t start, t end) tuples
+        read_id = self.addRead(query)
+        mate = MATES.index(read)
+        index = len(self.read_ids)
+
+        self.read_ids.append(read_id)
+        self.mates.append(mate)
+        self.strands.append(STRANDS[strand])
+        self.matches.append(matches)
+        self.t_gaps.append(t_gap)
+        self.q_gaps.append(q_gap)
+        self.block_offsets.append(len(self.q_starts))
+        self.block_counts.append(len(blocks))
+        self.next_alignment.append(-1)
+
+        read_order = sorted(blocks, key=lambda k: k[0], reverse=strand == '-')
+        self.span_starts.append(read_order[0][2])
+        self.span_ends.append(read_order[-1][3])
+
+        for q_start, q_end, t_start, t_end in blocks:
+            self.q_starts.append(q_start)
+            self.q_ends.append(q_end)
+            self.t_starts.append(t_start)
+            self.t_ends.append(t_end)
+
+        slot = 2 * read_id + mate
+        if self.tails[slot] == -1:
+            self.heads[slot] = index
+        else:
+            self.next_alignment[self.tails[slot]] = index
+        self.tails[slot] = index
+
+        return index
+
+    def alignments(self, query, read):
+        # Indices of the alignments stored for one mate of a read
+        index = self.heads[2 * self.read_index[query] + MATES.index(read)]
+        while index != -1:
+            yield index
+            index = self.next_alignment[index]
+
+    def shards(self, size):
+        # Split into stores of at most size reads each, keeping all the
+        # alignments of a read together and reads in their original order
+        for first in range(0, len(self.read_names), size):
+            shard = AlignmentStore()
+
+            for query in self.read_names[first:first + size]:
+                for read in MATES:
+                    for index in self.alignments(query, read):
+                        offset = self.block_offsets[index]
+                        shard.add(
+                            query,
+                            read,
+                            self.strand(index),
+                            self.matches[index],
+                            self.t_gaps[index],
+                            self.q_gaps[index],
+                            [
+                                (self.q_starts[i], self.q_ends[i], self.t_starts[i], self.t_ends[i])
+                                for i in range(offset, offset + self.block_counts[index])
+                            ],
+                        )
+
+            yield shard
+
+    def query(self, index):
+        return self.read_names[self.read_ids[index]]
+
+    def read(self, index):
+        return MATES[self.mates[index]]
+
+    def strand(self, index):
+        return '+' if self.strands[index] == 1 else '-'
+
+    def sortedBlocks(self, index):
+        # Block indices in read order: ascending q start on the plus strand,
+        # descending on the minus strand
+        offset = self.block_offsets[index]
+        return sorted(
+            range(offset, offset + self.block_counts[index]),
+            key=self.q_starts.__getitem__,
+            reverse=self.strands[index] == -1,
+        )
+
+    def targetRanges(self, index, seq_length):
+        # Reference ranges spanned by an alignment, split in two at the
+        # origin if its span wraps around it
+        start, end = self.span_starts[index], self.span_ends[index]
+        if start > end:
+            return [(1, end), (start, seq_length)]
+
+        return [(start, end)]
+
+    def key(self, index):
+        # Same hashable form readAlignments builds while parsing
+        offset = self.block_offsets[index]
+        return (
+            self.strand(index),
+            self.matches[index],
+            self.t_gaps[index],
+            self.q_gaps[index],
+            tuple(
+                (self.q_starts[i], self.q_ends[i], self.t_starts[i], self.t_ends[i])
+                for i in range(offset, offset + self.block_counts[index])
+            ),
+        )
+
+    def save(self, directory, key):
+        # One .npy file per column and the read names, one per line. The
+        # key is written last so an interrupted save is never loaded.
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        key_file = os.path.join(directory, 'key.txt')
+        if os.path.exists(key_file):
+            os.remove(key_file)
+
+        for name, typecode in COLUMNS:
+            numpy.save(
+                os.path.join(directory, name + '.npy'),
+                numpy.array(getattr(self, name), dtype=DTYPES[typecode]),
+            )
+        with open(os.path.join(directory, 'read_names.txt'), 'w') as OUTPUT:
+            for query in self.read_names:
+                OUTPUT.write(query + '\n')
+
+        with open(key_file, 'w') as OUTPUT:
+            OUTPUT.write(key + '\n')
+
+    @staticmethod
+    def load(directory, key):
+        # Store saved under key, or None if the cache is missing or was
+        # built from other inputs. Columns are memory-mapped and copied
+        # straight into typed arrays.
+        key_file = os.path.join(directory, 'key.txt')
+        if not os.path.exists(key_file):
+            return None
+        with open(key_file) as f:
+            if f.read().strip() != key:
+                return None
+
+        store = AlignmentStore()
+        for name, typecode in COLUMNS:
+            column = numpy.load(os.path.join(directory, name + '.npy'), mmap_mode='r')
+            setattr(store, name, array(typecode, column.tobytes()))
+            del column
+
+        with open(os.path.join(directory, 'read_names.txt')) as f:
+            for line in f:
+                query = intern(line.rstrip('\n'))
+                store.read_index[query] = len(store.read_names)
+                store.read_names.append(query)
+
+        return store
+
+    def blockTable(self):
+        # NumPy view of every block with the columns of its alignment
+        # repeated alongside, one row per block
+        counts = numpy.frombuffer(self.block_counts, dtype=numpy.intc)
+        alignment = numpy.repeat(numpy.arange(len(self), dtype=numpy.intc), counts)
+
+        return {
+            'alignment': alignment,
+            'read_id': numpy.frombuffer(self.read_ids, dtype=numpy.intc)[alignment],
+            'mate': numpy.frombuffer(self.mates, dtype=numpy.int8)[alignment],
+            'strand': numpy.frombuffer(self.strands, dtype=numpy.int8)[alignment],
+            'q_start': numpy.frombuffer(self.q_starts, dtype=numpy.intc),
+            'q_end': numpy.frombuffer(self.q_ends, dtype=numpy.intc),
+            't_start': numpy.frombuffer(self.t_starts, dtype=numpy.intc),
+            't_end': numpy.frombuffer(self.t_ends, dtype=numpy.intc),
+        }
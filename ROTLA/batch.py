@@ -0,0 +1,237 @@
+import errno
+import os
+import sys
+import traceback
+
+from multiprocessing import Pool
+from multiprocessing.sharedctypes import RawArray
+
+from ROTLA import ROTLA
+from compile_breakpoint_results import compile_breakpoints
+from kmer_aligner import KmerAligner
+from prescreen import KmerIndex
+from reference import Reference
+
+# Files of a sample that are inputs to later stages of find-breakpoints,
+# partial when it fails
+INTERMEDIATE_FILES = [
+    '.read_1.fasta', '.read_2.fasta',
+    '.read_1.psl', '.read_2.psl',
+    '.read_1.blat.out', '.read_2.blat.out',
+]
+
+
+class PreparedReference(object):
+    # Padded reference and indexes built once and shared by every sample of
+    # a batch
+
+    def __init__(self, ref_fn, contig, padded_fn, prescreen, aligner):
+        self.reference = Reference.load(ref_fn, contig)
+        self.reference.writePaddedFASTA(padded_fn)
+
+        self.padded_fn = padded_fn
+        self.ref_seq = self.reference.sequence
+        self.kmer_index = KmerIndex(self.ref_seq) if prescreen else None
+        self.kmer_aligner = KmerAligner(self.ref_seq) if aligner == 'kmer' else None
+
+
+class BatchROTLA(ROTLA):
+    # find-breakpoints for one sample of a batch, using the prepared
+    # reference instead of building its own
+
+    def __init__(self, prepared, **kwargs):
+        self.prepared = prepared
+        ROTLA.__init__(self, **kwargs)
+
+    def prepareReference(self):
+        self.reference = self.prepared.reference
+        self.reference_index = self.reference.reference_index
+        self.kmer_index = self.prepared.kmer_index
+        self.kmer_aligner = self.prepared.kmer_aligner
+
+        return self.prepared.padded_fn, self.prepared.ref_seq
+
+    def cleanFASTA(self):
+        # The padded reference belongs to the batch
+        if self.aligner == 'blat' and not self.stream_fasta and not self.blat_cached:
+            os.remove(self.output_header + ".read_1.fasta")
+            os.remove(self.output_header + ".read_2.fasta")
+
+
+def read_sample_sheet(sample_sheet):
+    # (read 1 FASTQ, read 2 FASTQ, sample name) per line, tab-separated,
+    # with no header line
+    samples = []
+    names = set()
+
+    with open(sample_sheet) as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            columns = line.rstrip('\r\n').split('\t')
+            if len(columns) != 3:
+                raise StandardError('Line {} of sample sheet {} has {} tab-separated columns instead of 3.'.format(
+                    line_number, sample_sheet, len(columns)))
+            read_1_fn, read_2_fn, name = columns
+            if name in names:
+                raise StandardError('Sample name {} is used more than once.'.format(name))
+            names.add(name)
+            samples.append((read_1_fn, read_2_fn, name))
+
+    return samples
+
+
+def init_batch_worker(reference, options, worker_pids):
+    global batch_reference, batch_options, batch_worker_pids
+    batch_reference = reference
+    batch_options = options
+    batch_worker_pids = worker_pids
+
+
+def remove_intermediate_files(output_prefix):
+    for extension in INTERMEDIATE_FILES:
+        if os.path.exists(output_prefix + extension):
+            os.remove(output_prefix + extension)
+
+
+def worker_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as error:
+        return error.errno != errno.ESRCH
+    return True
+
+
+def run_sample(index, sample):
+    # Run one sample in a pool worker. Any error is returned rather than
+    # raised so the other samples carry on, and the sample's intermediate
+    # files are removed. The worker's pid is recorded first, so the batch
+    # can tell when the worker dies without returning.
+    read_1_fn, read_2_fn, output_prefix = sample
+    batch_worker_pids[index] = os.getpid()
+
+    try:
+        BatchROTLA(
+            batch_reference,
+            read_1_file_name=read_1_fn,
+            read_2_file_name=read_2_fn,
+            output_prefix=output_prefix,
+            **batch_options
+        )
+    except Exception:
+        error = traceback.format_exc()
+        remove_intermediate_files(output_prefix)
+        return error
+
+    return None
+
+
+def wait_for_samples(results, worker_pids, output_prefixes):
+    # Errors of each sample once every result is in. A worker killed while
+    # running a sample (by a segfault or the OOM killer) never returns its
+    # result, so a sample whose worker has exited counts as failed.
+    errors = [None] * len(results)
+    lost = []
+    pending = list(range(len(results)))
+
+    while pending:
+        results[pending[0]].wait(0.1)
+        for index in list(pending):
+            pid = worker_pids[index]
+            if not results[index].ready():
+                if not pid or worker_alive(pid):
+                    continue
+
+                # Give a result sent just before the worker exited time to
+                # arrive
+                results[index].wait(1)
+
+            if results[index].ready():
+                errors[index] = results[index].get()
+            else:
+                errors[index] = 'Worker process {} exited while running the sample.\n'.format(pid)
+                remove_intermediate_files(output_prefixes[index])
+                lost.append(index)
+            pending.remove(index)
+
+    return errors, lost
+
+
+def find_breakpoints_batch(sample_sheet, reference_sequence, output_directory,
+                           workers=1, **kwargs):
+    # Run find-breakpoints on every sample of the sheet, workers samples at a
+    # time, then combine breakpoint tables and aligned base counts of the
+    # samples that finished. Returns the names of samples that failed.
+    samples = read_sample_sheet(sample_sheet)
+
+    if not os.path.isdir(output_directory):
+        os.makedirs(output_directory)
+    output_prefixes = [os.path.join(output_directory, name) for _, _, name in samples]
+
+    reference = PreparedReference(
+        reference_sequence,
+        kwargs['contig'],
+        os.path.join(output_directory, 'padded_reference.fasta'),
+        kwargs['prescreen'],
+        kwargs['aligner'],
+    )
+
+    # Samples run one process each, so breakpoint detection within a sample
+    # stays in that process
+    options = dict(kwargs)
+    options.update({
+        'reference_sequence': reference_sequence,
+        'threads': 1,
+        'aligned_bases': True,
+        'profile': False,
+    })
+
+    worker_pids = RawArray('i', len(samples))
+    pool = Pool(workers, init_batch_worker, (reference, options, worker_pids))
+    lost = None
+    try:
+        results = [
+            pool.apply_async(run_sample, (index, (read_1_fn, read_2_fn, output_prefix)))
+            for index, ((read_1_fn, read_2_fn, name), output_prefix) in enumerate(zip(samples, output_prefixes))
+        ]
+        errors, lost = wait_for_samples(results, worker_pids, output_prefixes)
+    finally:
+        # The pool keeps waiting on the tasks of dead workers, so it can only
+        # be closed once no task was lost
+        if lost == []:
+            pool.close()
+        else:
+            pool.terminate()
+        pool.join()
+        os.remove(reference.padded_fn)
+
+    failed = []
+    with open(os.path.join(output_directory, 'samples.txt'), 'w') as OUTPUT:
+        for (read_1_fn, read_2_fn, name), error in zip(samples, errors):
+            if error:
+                failed.append(name)
+                sys.stderr.write('Sample {} failed:\n{}'.format(name, error))
+                OUTPUT.write('{}\t{}\t{}\n'.format(name, 'failed', error.strip().splitlines()[-1]))
+            else:
+                OUTPUT.write('{}\t{}\n'.format(name, 'ok'))
+
+    # Combine the samples that finished
+    finished = [
+        (name, output_prefix)
+        for (read_1_fn, read_2_fn, name), output_prefix, error in zip(samples, output_prefixes, errors)
+        if not error
+    ]
+
+    list_file = os.path.join(output_directory, 'breakpoint_list.txt')
+    with open(list_file, 'w') as OUTPUT:
+        for name, output_prefix in finished:
+            OUTPUT.write('{}\t{}\n'.format(output_prefix + '.breakpoints.txt', name))
+    compile_breakpoints(list_file, os.path.join(output_directory, 'breakpoints.txt'))
+
+    with open(os.path.join(output_directory, 'aligned_bases.txt'), 'w') as OUTPUT:
+        for name, output_prefix in finished:
+            with open(output_prefix + '.aligned_bases.txt') as f:
+                count = f.readline().strip().split('\t')[-1]
+            OUTPUT.write('{}\t{}\n'.format(name, count))
+
+    return failed
@@ -0,0 +1,414 @@
+import filecmp
+import json
+import os
+import random
+import shutil
+import stat
+import string
+import sys
+
+from collections import OrderedDict
+
+from __init__ import PATHS
+from ROTLA import ROTLA
+from aligned_bases_from_psl import get_aligned_bases
+from kmer_aligner import PSL_HEADER
+from metrics import Metrics
+
+COMPLEMENT = string.maketrans('ACGT', 'TGCA')
+
+# Deletions carried by simulated mutant molecules, as (first deleted base,
+# first retained base after it) in 0-based reference coordinates, and the
+# length of the direct repeat placed at both ends. These include the common
+# 4977 bp deletion between 13 bp repeats, one spanning the origin, and ones
+# with no repeat.
+DELETIONS = [
+    (8470, 13447, 13),
+    (16000, 600, 9),
+    (6330, 13994, 7),
+    (3000, 5000, 0),
+    (10000, 15000, 0),
+]
+
+# Stand-in for BLAT with the same command line: copies the lines of the
+# simulated PSL file of the matching mate for every query in the FASTA
+STUB_BLAT = '''#!{python}
+import sys
+reference, fasta_file, psl_file = sys.argv[1:4]
+source = {directory!r} + ('/read_1.psl' if 'read_1' in fasta_file else '/read_2.psl')
+names = set()
+with open(fasta_file) as f:
+    for line in f:
+        if line[0] == '>':
+            names.add(line[1:].split()[0])
+with open(source) as f, open(psl_file, 'w') as OUTPUT:
+    for i, line in enumerate(f):
+        if i < 5 or line.split('\\t', 10)[9] in names:
+            OUTPUT.write(line)
+'''
+
+
+def simulate_reference(length, rng):
+    sequence = [rng.choice('ACGT') for i in range(length)]
+    for start, end, repeat in DELETIONS:
+        for i in range(repeat):
+            sequence[(end + i) % length] = sequence[(start + i) % length]
+
+    return ''.join(sequence)
+
+
+def alignment_blocks(positions, length):
+    # [q start, padded t start, size] blocks of a read covering reference
+    # positions, placed so t starts increase along the padded reference.
+    # Runs across the origin stay one block, as on the padded reference.
+    blocks = []
+    for q, position in enumerate(positions):
+        if blocks and position == (blocks[-1][1] + blocks[-1][2]) % length:
+            blocks[-1][2] += 1
+        else:
+            blocks.append([q, position, 1])
+
+    previous = -1
+    for block in blocks:
+        while block[1] <= previous:
+            block[1] += length
+        previous = block[1] + block[2] - 1
+    if blocks[-1][1] + blocks[-1][2] > 2 * length:
+        for block in blocks:
+            block[1] -= length
+
+    return blocks
+
+
+def psl_line(name, strand, blocks, read_length, length):
+    matches = sum(size for q, t, size in blocks)
+    q_gaps = sum(1 for a, b in zip(blocks, blocks[1:]) if b[0] != a[0] + a[2])
+    t_gaps = sum(1 for a, b in zip(blocks, blocks[1:]) if b[1] != a[1] + a[2])
+    q_start = blocks[0][0]
+    q_end = blocks[-1][0] + blocks[-1][2]
+    if strand == '-':
+        q_start, q_end = read_length - q_end, read_length - q_start
+
+    return '\t'.join(str(column) for column in [
+        matches, 0, 0, 0, q_gaps, 0, t_gaps, 0, strand, name, read_length,
+        q_start, q_end, 'Padded', 2 * length, blocks[0][1],
+        blocks[-1][1] + blocks[-1][2], len(blocks),
+        ''.join('{},'.format(size) for q, t, size in blocks),
+        ''.join('{},'.format(q) for q, t, size in blocks),
+        ''.join('{},'.format(t) for q, t, size in blocks),
+    ]) + '\n'
+
+
+def spurious_split(name, strand, rng, read_length, length):
+    # PSL line of a two-block hit of a read at random reference positions
+    split = rng.randint(20, 60)
+    t_1 = rng.randrange(length)
+    t_2 = t_1 + split + rng.randint(50, 1500)
+    if t_2 + read_length - split > 2 * length:
+        return None
+
+    return psl_line(
+        name, strand,
+        [[0, t_1, split], [split, t_2, read_length - split]],
+        read_length, length,
+    )
+
+
+def simulate(directory, pairs, seed=1, length=16569, read_length=100, mutant_fraction=0.3,
+             multi_hits=0):
+    # Write a circular reference, paired FASTQ files of fragments from wild
+    # type and deleted molecules, and the PSL files BLAT would give for
+    # them, with repeated lines, partial hits and spurious splits mixed in.
+    # With multi_hits, every aligned mate also gets that many extra hits,
+    # each a spurious split or a repeat of an earlier one, as BLAT gives
+    # for reads from repetitive sequence.
+    rng = random.Random(seed)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    reference = simulate_reference(length, rng)
+    with open(os.path.join(directory, 'reference.fasta'), 'w') as OUTPUT:
+        OUTPUT.write('>chrM\n')
+        for i in range(0, length, 70):
+            OUTPUT.write(reference[i:i + 70] + '\n')
+
+    fastqs = [open(os.path.join(directory, read + '.fastq'), 'w') for read in ['read_1', 'read_2']]
+    psls = [open(os.path.join(directory, read + '.psl'), 'w') for read in ['read_1', 'read_2']]
+    for psl in psls:
+        psl.write(PSL_HEADER)
+
+    for pair in range(pairs):
+        name = '@sim{}'.format(pair)
+        if rng.random() < mutant_fraction:
+            start, end, repeat = rng.choice(DELETIONS)
+            molecule = [(end + i) % length for i in range(length - (end - start) % length)]
+        else:
+            molecule = range(length)
+
+        offset = rng.randrange(len(molecule))
+        fragment = [molecule[(offset + i) % len(molecule)] for i in range(rng.randint(150, 400))]
+        mates = [(fragment[:read_length], '+'), (fragment[-read_length:], '-')]
+
+        for mate, ((positions, strand), fastq, psl) in enumerate(zip(mates, fastqs, psls)):
+            sequence = ''.join(reference[position] for position in positions)
+            if strand == '-':
+                sequence = sequence.translate(COMPLEMENT)[::-1]
+            fastq.write('{} {}:N:0\n{}\n+\n{}\n'.format(name, mate + 1, sequence, 'I' * read_length))
+
+            if rng.random() < 0.03:
+                continue
+            blocks = alignment_blocks(positions, length)
+            line = psl_line(name, strand, blocks, read_length, length)
+            psl.write(line)
+
+            for i in range(rng.choice([0, 0, 0, 1, 2])):
+                kind = rng.random()
+                if kind < 0.4:
+                    psl.write(line)
+                elif kind < 0.8 and blocks[-1][2] > 40:
+                    partial = [list(block) for block in blocks]
+                    partial[-1][2] -= rng.randint(20, 40)
+                    psl.write(psl_line(name, strand, partial, read_length, length))
+                else:
+                    split = spurious_split(name, strand, rng, read_length, length)
+                    if split:
+                        psl.write(split)
+
+            extra_hits = []
+            for i in range(multi_hits):
+                if extra_hits and rng.random() < 0.5:
+                    psl.write(rng.choice(extra_hits))
+                    continue
+                split = spurious_split(name, strand, rng, read_length, length)
+                if split:
+                    extra_hits.append(split)
+                    psl.write(split)
+
+    for handle in fastqs + psls:
+        handle.close()
+
+
+def simulate_aligned_reads(directory, reads, seed=1, length=16569, read_length=100):
+    # Write a reference and the read 1 and read 2 PSL files BLAT would give
+    # for reads pairs, without FASTQ files, for get-aligned-bases. Each
+    # mate has one hit on the padded reference, some split in two blocks
+    # and some running across the origin, and the mates of a pair overlap
+    # or lie close together.
+    rng = random.Random(seed)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    reference = simulate_reference(length, rng)
+    with open(os.path.join(directory, 'reference.fasta'), 'w') as OUTPUT:
+        OUTPUT.write('>chrM\n')
+        for i in range(0, length, 70):
+            OUTPUT.write(reference[i:i + 70] + '\n')
+
+    psls = [open(os.path.join(directory, 'sample.' + read + '.psl'), 'w') for read in ['read_1', 'read_2']]
+    for psl in psls:
+        psl.write(PSL_HEADER)
+
+    for pair in range(reads):
+        name = 'read{}'.format(pair)
+        t_start = rng.randrange(length)
+        for strand, psl in zip('+-', psls):
+            if rng.random() < 0.2:
+                split = rng.randint(20, read_length - 20)
+                blocks = [[0, t_start, split], [split, t_start + split + rng.randint(50, 1500), read_length - split]]
+            else:
+                blocks = [[0, t_start, read_length]]
+            if blocks[-1][1] + blocks[-1][2] <= 2 * length:
+                psl.write(psl_line(name, strand, blocks, read_length, length))
+            t_start += rng.randint(0, 300)
+
+    for psl in psls:
+        psl.close()
+
+    return os.path.join(directory, 'sample')
+
+
+def run_aligned_bases(output_directory, read_counts, seed=1):
+    # Time get-aligned-bases on simulated PSL files of each number of read
+    # pairs, into aligned_base_reads.txt
+    if not os.path.isdir(output_directory):
+        os.makedirs(output_directory)
+
+    rows = []
+    for reads in read_counts:
+        directory = os.path.join(output_directory, 'seed_{}.reads_{}'.format(seed, reads))
+        prefix = simulate_aligned_reads(directory, reads, seed)
+        get_aligned_bases(prefix, os.path.join(directory, 'reference.fasta'))
+
+        with open(prefix + '.aligned_bases.metrics.json') as f:
+            metrics = json.load(f, object_pairs_hook=OrderedDict)
+        for stage, values in metrics['stages'].items():
+            rows.append([
+                reads, stage, values['wall_seconds'], values['cpu_seconds'], values['peak_rss_kb'],
+            ])
+
+    with open(os.path.join(output_directory, 'aligned_base_reads.txt'), 'w') as OUTPUT:
+        OUTPUT.write('Read pairs\tStage\tWall seconds\tCPU seconds\tPeak RSS KB\n')
+        for row in rows:
+            OUTPUT.write('\t'.join(str(value) for value in row) + '\n')
+
+
+def simulate_breakpoints(size, rng, length=16569):
+    # Reference and table of size distinct breakpoints with random counts.
+    # Most sit between direct repeats planted in the reference, with every
+    # shift of the breakpoint through its repeat also in the table, so
+    # compareAcrossAllBreaks has chains of breakpoints to merge.
+    sequence = [rng.choice('ACGT') for i in range(length)]
+    break_count = dict()
+
+    while len(break_count) < size:
+        start = rng.randint(1, length - 6000)
+        end = start + rng.randint(500, 5000)
+        repeat = rng.choice([0, 0, 2, 5, 9, 13])
+        for i in range(repeat):
+            sequence[end - 1 + i] = sequence[start + i]
+        for shift in range(min(repeat + 1, size - len(break_count))):
+            break_count[(start + shift, end + shift)] = rng.randint(1, 20)
+
+    return ''.join(sequence), break_count
+
+
+class BreakpointTable(ROTLA):
+    # compareAcrossAllBreaks on a given breakpoint table, without reads
+
+    def __init__(self, break_count):
+        self.break_count = break_count
+        self.unique_break_count = None
+
+
+def run_breakpoint_sets(output_directory, sizes, seed=1):
+    # Time compareAcrossAllBreaks on simulated breakpoint tables of each
+    # size, into breakpoint_sets.txt
+    rng = random.Random(seed)
+    if not os.path.isdir(output_directory):
+        os.makedirs(output_directory)
+
+    with open(os.path.join(output_directory, 'breakpoint_sets.txt'), 'w') as OUTPUT:
+        OUTPUT.write('Breakpoints\tMerged breakpoints\tPasses\tWall seconds\tCPU seconds\tPeak RSS KB\n')
+        for size in sizes:
+            ref_seq, break_count = simulate_breakpoints(size, rng)
+            table = BreakpointTable(break_count)
+
+            metrics = Metrics('benchmark')
+            with metrics.stage('compare_across_all_breaks'):
+                table.compareAcrossAllBreaks(ref_seq)
+            values = metrics.stages['compare_across_all_breaks']
+
+            OUTPUT.write('\t'.join(str(value) for value in [
+                size, len(table.break_count), table.merge_stats['passes'],
+                values['wall_seconds'], values['cpu_seconds'], values['peak_rss_kb'],
+            ]) + '\n')
+
+
+def write_stub_blat(directory):
+    stub = os.path.join(directory, 'blat')
+    with open(stub, 'w') as OUTPUT:
+        OUTPUT.write(STUB_BLAT.format(python=sys.executable, directory=os.path.abspath(directory)))
+    os.chmod(stub, os.stat(stub).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+    return stub
+
+
+def run_simulation(directory, **kwargs):
+    # find-breakpoints and get-aligned-bases on a simulated sample, with the
+    # stub in place of BLAT. Returns the output prefix.
+    prefix = os.path.join(directory, 'sample')
+    options = {
+        'read_1_file_name': os.path.join(directory, 'read_1.fastq'),
+        'read_2_file_name': os.path.join(directory, 'read_2.fastq'),
+        'reference_sequence': os.path.join(directory, 'reference.fasta'),
+        'contig': None,
+        'output_prefix': prefix,
+        'length': 25,
+        'threads': 1,
+        'blat_chunks': 1,
+        'blat_jobs': 2,
+        'stream_fasta': False,
+        'prescreen': False,
+        'prescreen_mismatches': 0,
+        'aligned_bases': False,
+        'alignment_cache': False,
+        'blat_cache': None,
+        'blat_cache_size': 50,
+        'aligner': 'blat',
+        'collapse_duplicates': False,
+        'profile': False,
+    }
+    options.update(kwargs)
+
+    blat_path = PATHS.get('blat')
+    PATHS['blat'] = write_stub_blat(directory)
+    try:
+        ROTLA(**options)
+    finally:
+        PATHS['blat'] = blat_path
+    get_aligned_bases(prefix, options['reference_sequence'], contig=options['contig'])
+
+    return prefix
+
+
+def read_aligned_bases(file_name):
+    with open(file_name) as f:
+        return f.readline().strip().split('\t')[-1]
+
+
+def run_benchmark(output_directory, depths, seed=1, record=None, golden=None, multi_hits=0, **kwargs):
+    # Simulate a sample at each depth (read pairs), run it and collect stage
+    # times into benchmark.txt. With record, outputs are saved there as
+    # golden files; with golden, they are compared against saved ones.
+    # Returns the names of golden files that differ or are missing.
+    rows = []
+    mismatches = []
+
+    if not os.path.isdir(output_directory):
+        os.makedirs(output_directory)
+    if record and not os.path.isdir(record):
+        os.makedirs(record)
+
+    for pairs in depths:
+        name = 'seed_{}.pairs_{}'.format(seed, pairs)
+        if multi_hits:
+            name += '.hits_{}'.format(multi_hits)
+        directory = os.path.join(output_directory, name)
+        simulate(directory, pairs, seed, multi_hits=multi_hits)
+        prefix = run_simulation(directory, **kwargs)
+
+        for metrics_file in [prefix + '.metrics.json', prefix + '.aligned_bases.metrics.json']:
+            with open(metrics_file) as f:
+                metrics = json.load(f, object_pairs_hook=OrderedDict)
+            for stage, values in metrics['stages'].items():
+                rows.append([
+                    pairs, metrics['command'], stage, values['wall_seconds'],
+                    values['cpu_seconds'], values['child_cpu_seconds'], values['peak_rss_kb'],
+                ])
+
+        aligned_bases = read_aligned_bases(prefix + '.aligned_bases.txt')
+        outputs = [
+            (name + '.breakpoints.txt', prefix + '.breakpoints.txt'),
+            (name + '.aligned_bases.txt', None),
+        ]
+        if record:
+            shutil.copyfile(prefix + '.breakpoints.txt', os.path.join(record, name + '.breakpoints.txt'))
+            with open(os.path.join(record, name + '.aligned_bases.txt'), 'w') as OUTPUT:
+                OUTPUT.write('{}\t{}\n'.format(name, aligned_bases))
+        if golden:
+            for golden_name, output_file in outputs:
+                golden_file = os.path.join(golden, golden_name)
+                if not os.path.exists(golden_file):
+                    mismatches.append(golden_name)
+                elif output_file is None:
+                    if read_aligned_bases(golden_file) != aligned_bases:
+                        mismatches.append(golden_name)
+                elif not filecmp.cmp(golden_file, output_file, shallow=False):
+                    mismatches.append(golden_name)
+
+    with open(os.path.join(output_directory, 'benchmark.txt'), 'w') as OUTPUT:
+        OUTPUT.write('Pairs\tCommand\tStage\tWall seconds\tCPU seconds\tChild CPU seconds\tPeak RSS KB\n')
+        for row in rows:
+            OUTPUT.write('\t'.join(str(value) for value in row) + '\n')
+
+    return mismatches
@@ -0,0 +1,204 @@
+import errno
+import fcntl
+import os
+import time
+
+from multiprocessing.pool import ThreadPool
+from threading import Event, Lock, Thread
+from subprocess import Popen, CalledProcessError
+
+PSL_HEADER_LINES = 5
+
+
+def split_fasta(fasta_file, chunk_files):
+    # Cut a FASTA file at record boundaries into one piece per chunk file,
+    # each about the same size, keeping records in their original order
+    size = os.path.getsize(fasta_file)
+
+    with open(fasta_file) as f:
+        offsets = [0]
+        for i in range(1, len(chunk_files)):
+            f.seek(max(size * i // len(chunk_files), offsets[-1]))
+            if f.tell() > 0:
+                f.readline()
+            while True:
+                position = f.tell()
+                line = f.readline()
+                if not line or line[0] == ">":
+                    break
+            offsets.append(position)
+        offsets.append(size)
+
+        for chunk_file, start, end in zip(chunk_files, offsets[:-1], offsets[1:]):
+            f.seek(start)
+            with open(chunk_file, "w") as OUTPUT:
+                remaining = end - start
+                while remaining > 0:
+                    block = f.read(min(remaining, 1 << 20))
+                    OUTPUT.write(block)
+                    remaining -= len(block)
+
+
+def concatenate_files(input_files, output_file, skip_lines=0):
+    # Write input files one after another, dropping the first skip_lines
+    # lines of every file after the first
+    with open(output_file, "w") as OUTPUT:
+        for i, input_file in enumerate(input_files):
+            with open(input_file) as f:
+                if i > 0:
+                    for j in range(skip_lines):
+                        next(f, None)
+                for line in f:
+                    OUTPUT.write(line)
+
+
+def run_jobs(jobs, limit):
+    # Run (command, stdout file) jobs with at most limit at once. Once a job
+    # exits non-zero, jobs still running are terminated, no more are
+    # started, and CalledProcessError is raised for it.
+    lock = Lock()
+    processes = []
+    failures = []
+
+    def run(job):
+        command, stdout_file = job
+        with lock:
+            if failures:
+                return
+            stdout = open(stdout_file, "w")
+            process = Popen(command, stdout=stdout)
+            processes.append(process)
+
+        return_code = process.wait()
+        stdout.close()
+
+        if return_code != 0:
+            with lock:
+                if not failures:
+                    for other in processes:
+                        if other is not process and other.returncode is None:
+                            try:
+                                other.terminate()
+                            except OSError:
+                                pass
+                failures.append(CalledProcessError(return_code, command))
+
+    pool = ThreadPool(max(1, min(limit, len(jobs))))
+    try:
+        pool.map(run, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+    if failures:
+        raise failures[0]
+
+
+def open_fifo(fifo_file, stop):
+    # Open a named pipe for writing once its BLAT process opens it for
+    # reading. The open polls rather than blocks, so a BLAT process that
+    # exits before opening its pipe cannot hang the feeder; it gives up
+    # once stop is set.
+    while True:
+        try:
+            fd = os.open(fifo_file, os.O_WRONLY | os.O_NONBLOCK)
+            break
+        except OSError as error:
+            if error.errno != errno.ENXIO or stop.is_set():
+                raise
+            time.sleep(0.01)
+
+    fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) & ~os.O_NONBLOCK)
+    return os.fdopen(fd, "w")
+
+
+def feed_fifos(writer, fifo_files, errors, stop):
+    # Open the named pipes of every input and let writer fill them. If a
+    # BLAT process exits early, writing to its pipe fails and the feeder
+    # stops, closing every pipe.
+    try:
+        handles = []
+        try:
+            for input_fifos in fifo_files:
+                handles.append([])
+                for fifo_file in input_fifos:
+                    handles[-1].append(open_fifo(fifo_file, stop))
+            writer(handles)
+        finally:
+            for input_handles in handles:
+                for handle in input_handles:
+                    handle.close()
+    except Exception as error:
+        errors.append(error)
+
+
+def run_blat(blat_path, reference, fasta_files, psl_files, stdout_files,
+             chunks=1, jobs=2, writer=None):
+    # Align every FASTA file against the reference, splitting each into
+    # chunks run as separate BLAT processes, at most jobs at a time. Chunk
+    # output is joined back into one PSL (with a single header) and one
+    # STDOUT file per input.
+    #
+    # If writer is given, no FASTA is read from disk: fasta_files become
+    # named pipes and writer(handles) streams into them, where handles[i]
+    # holds the pipes of the chunks of input i. Every BLAT process must then
+    # be reading at once, so jobs is raised to the number of pipes.
+    commands = []
+    merges = []
+    fifos = []
+
+    for fasta_file, psl_file, stdout_file in zip(fasta_files, psl_files, stdout_files):
+        if chunks == 1:
+            chunk_fastas = [fasta_file]
+            commands.append(([blat_path, reference, fasta_file, psl_file], stdout_file))
+        else:
+            prefix = os.path.splitext(fasta_file)[0]
+            chunk_fastas = [prefix + ".chunk_{}.fasta".format(j) for j in range(chunks)]
+            chunk_psls = [prefix + ".chunk_{}.psl".format(j) for j in range(chunks)]
+            chunk_stdouts = [prefix + ".chunk_{}.blat.out".format(j) for j in range(chunks)]
+
+            if not writer:
+                split_fasta(fasta_file, chunk_fastas)
+            for chunk_fasta, chunk_psl, chunk_stdout in zip(chunk_fastas, chunk_psls, chunk_stdouts):
+                commands.append(([blat_path, reference, chunk_fasta, chunk_psl], chunk_stdout))
+            merges.append((psl_file, stdout_file, chunk_fastas, chunk_psls, chunk_stdouts))
+
+        if writer:
+            fifos.append(chunk_fastas)
+
+    feeder = None
+    errors = []
+    stop = Event()
+    try:
+        if writer:
+            for input_fifos in fifos:
+                for fifo_file in input_fifos:
+                    os.mkfifo(fifo_file)
+            feeder = Thread(target=feed_fifos, args=(writer, fifos, errors, stop))
+            feeder.daemon = True
+            feeder.start()
+            jobs = max(jobs, len(commands))
+
+        try:
+            run_jobs(commands, jobs)
+        finally:
+            # Every BLAT process has exited, so the feeder ends: it gives up
+            # on pipes nothing will open, and writes to closed ones fail
+            if feeder:
+                stop.set()
+                feeder.join()
+        if errors:
+            raise errors[0]
+
+        for psl_file, stdout_file, chunk_fastas, chunk_psls, chunk_stdouts in merges:
+            concatenate_files(chunk_psls, psl_file, skip_lines=PSL_HEADER_LINES)
+            concatenate_files(chunk_stdouts, stdout_file)
+    finally:
+        temporary_files = [fifo_file for input_fifos in fifos for fifo_file in input_fifos]
+        for merge in merges:
+            for chunk_files in merge[2:]:
+                temporary_files.extend(chunk_files)
+
+        for temporary_file in set(temporary_files):
+            if os.path.exists(temporary_file):
+                os.remove(temporary_file)
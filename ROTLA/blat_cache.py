@@ -0,0 +1,110 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+# Bump when the files stored in an entry or how they are produced changes
+CACHE_VERSION = 1
+
+
+def file_digest(file_name, digest):
+    with open(file_name, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), ''):
+            digest.update(block)
+    digest.update('\n')
+
+
+class BlatCache(object):
+    # On-disk store of BLAT results, one directory per entry named by a
+    # digest of everything that determines them: the read files, the padded
+    # reference, the BLAT binary and the options that change what reaches
+    # BLAT. Entries are used at most max_bytes in total, and the least
+    # recently used are removed first when a new entry pushes the cache over.
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, input_files, options):
+        digest = hashlib.sha1('{}\n'.format(CACHE_VERSION))
+        for input_file in input_files:
+            file_digest(input_file, digest)
+        for option in options:
+            digest.update('{}\n'.format(option))
+
+        return digest.hexdigest()
+
+    def fetch(self, key, output_files):
+        # Copy an entry's files to output_files (a dict of entry file name
+        # to destination) and mark it as recently used. Returns False if
+        # there is no complete entry for key.
+        entry = os.path.join(self.directory, key)
+        if not os.path.isdir(entry) or \
+                not all(os.path.exists(os.path.join(entry, name)) for name in output_files):
+            return False
+
+        for name, output_file in output_files.items():
+            shutil.copyfile(os.path.join(entry, name), output_file)
+        os.utime(entry, None)
+
+        return True
+
+    def store(self, key, input_files):
+        # Add an entry holding input_files (a dict of entry file name to
+        # source) and evict old entries. Entries are built under a temporary
+        # name and renamed into place, so concurrent runs never see a
+        # partial entry. Returns the number of entries evicted.
+        entry = os.path.join(self.directory, key)
+        temporary = tempfile.mkdtemp(prefix='.' + key, dir=self.directory)
+
+        try:
+            for name, input_file in input_files.items():
+                shutil.copyfile(input_file, os.path.join(temporary, name))
+            os.rename(temporary, entry)
+        except OSError:
+            # Another run stored the same entry first
+            if not os.path.isdir(entry):
+                raise
+        finally:
+            if os.path.isdir(temporary):
+                shutil.rmtree(temporary)
+
+        return self.evict(keep=key)
+
+    def entries(self):
+        # (last use, size in bytes, path) of each complete entry
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith('.') or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(
+                    os.path.getsize(os.path.join(path, file_name))
+                    for file_name in os.listdir(path)
+                )
+                entries.append((os.path.getmtime(path), size, path))
+            except OSError:
+                # Evicted by a concurrent run
+                continue
+
+        return entries
+
+    def evict(self, keep=None):
+        entries = sorted(self.entries())
+        total = sum(size for last_use, size, path in entries)
+
+        evicted = 0
+        for last_use, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if os.path.basename(path) == keep:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            evicted += 1
+
+        return evicted
@@ -4,10 +4,25 @@
 
 import click
 import os
+import sys
+
+from subprocess import CalledProcessError
 
 from ROTLA import ROTLA as _find_breakpoints
+from ROTLA import RescanROTLA as _rescan_breakpoints
+from batch import find_breakpoints_batch as _find_breakpoints_batch
+from benchmark import run_benchmark as _run_benchmark
+from benchmark import run_breakpoint_sets as _run_breakpoint_sets
+from benchmark import run_aligned_bases as _run_aligned_bases
 from compile_breakpoint_results import compile_breakpoints as _compile_breakpoints
 from aligned_bases_from_psl import get_aligned_bases as _get_aligned_bases
+from cohort_store import append_samples as _append_samples
+from cohort_store import export_cohort as _export_cohort
+
+def check_output_options(compression, output_format):
+    if compression and output_format != 'tsv':
+        sys.stderr.write('--compression applies only to --output-format tsv\n')
+        sys.exit(1)
 
 @click.group()
 def main(args=None):
@@ -16,39 +31,313 @@ def main(args=None):
 @main.command()
 @click.option('--length', type=int, help='Minimum required alignment length, default = 25',
               default=25)
+@click.option('--contig', type=str, default=None,
+              help='Name of the sequence to use when the reference FASTA holds more than one')
+@click.option('--threads', type=int, help='Number of processes for breakpoint detection and the kmer aligner, default = 1',
+              default=1)
+@click.option('--blat-chunks', type=int, help='Number of pieces each read FASTA is split into for BLAT, default = 1',
+              default=1)
+@click.option('--blat-jobs', type=int, help='Maximum number of concurrent BLAT processes, default = 2',
+              default=2)
+@click.option('--stream-fasta', is_flag=True,
+              help='Stream reads to BLAT through named pipes instead of writing FASTA files')
+@click.option('--prescreen', is_flag=True,
+              help='Skip read pairs whose mates both align contiguously to the reference')
+@click.option('--prescreen-mismatches', type=int,
+              help='Mismatches allowed in a contiguous prescreen match, default = 0', default=0)
+@click.option('--aligned-bases', is_flag=True,
+              help='Also count aligned bases while reading the PSL files, as get-aligned-bases does')
+@click.option('--alignment-cache', is_flag=True,
+              help='Save parsed split-read alignments for rescan-breakpoints')
+@click.option('--blat-cache', type=str, default=None,
+              help='Directory of cached BLAT results to reuse and add to')
+@click.option('--blat-cache-size', type=float, default=50,
+              help='Maximum size of the BLAT cache in GB, default = 50')
+@click.option('--aligner', type=click.Choice(['blat', 'kmer']), default='blat',
+              help='Align reads with BLAT or with the built-in k-mer aligner, default = blat')
+@click.option('--collapse-duplicates', is_flag=True,
+              help='Align each distinct read pair once, counting its copies')
+@click.option('--profile', is_flag=True,
+              help='Write cProfile stats of the Python stages to [output_prefix].profile')
 @click.argument('read_1_fastq_file', type=str)
 @click.argument('read_2_fastq_file', type=str)
 @click.argument('reference_sequence', type=str)
 @click.argument('output_prefix', type=str)
 def find_breakpoints(read_1_fastq_file, read_2_fastq_file, reference_sequence,
-                     output_prefix, length):
+                     output_prefix, length, contig, threads, blat_chunks, blat_jobs,
+                     stream_fasta, prescreen, prescreen_mismatches, aligned_bases,
+                     alignment_cache, blat_cache, blat_cache_size, aligner,
+                     collapse_duplicates, profile):
     '''
     Identify mitochondrial breakpoints.
 
     Given a set of paired-end FASTQ files and FASTA reference sequence,
     identify breakpoint coordinates and determine count of supporting
-    reads.
+    reads. The repeat index of the reference is saved alongside the FASTA
+    in [reference_sequence].rotla_index and reused by later runs, of any
+    command, while the reference sequence has the same MD5 checksum.
 
     This command will produce the following output files, with each
     name below preceded by the provided output_prefix:
 
     .read_1.psl         Output of Read 1 FASTQ blat alignment in psl format
     .read_2.psl         Output of Read 2 FASTQ blat alignment in psl format
-    .read_1.blat.out    Content written to STDOUT during Read 1 blat alignment
-    .read_2.blat.out    Content written to STDOUT during Read 2 blat alignment
+    .read_1.blat.out    Content written to STDOUT during Read 1 blat alignment;
+                        not written with --aligner kmer
+    .read_2.blat.out    Content written to STDOUT during Read 2 blat alignment;
+                        not written with --aligner kmer
     .breakpoints.txt    Tab-delimited table of breakpoint start, end, counts
+    .prescreen.txt      Read pairs seen and skipped by --prescreen, with the
+                        aligned bases of the skipped pairs
+    .aligned_bases.txt  Written with --aligned-bases; same as the output of
+                        get-aligned-bases
+    .pair_copies.txt    Written with --collapse-duplicates; name and number
+                        of copies of each aligned pair with more than one
+    .duplicates.txt     Written with --collapse-duplicates; read pairs seen
+                        and unique, with the aligned bases of unique pairs
+                        skipped by --prescreen
+    .unique_breakpoints.txt
+                        Written with --collapse-duplicates; as
+                        .breakpoints.txt, counting each distinct pair once
+    .unique_aligned_bases.txt
+                        Written with --collapse-duplicates and
+                        --aligned-bases; as .aligned_bases.txt, counting
+                        each distinct pair once
+    .alignments         Written with --alignment-cache; directory of parsed
+                        split-read alignments used by rescan-breakpoints
+    .blat_cache.txt     Written with --blat-cache; cache key, hit and miss
+                        counts for this run, and entries evicted
+    .metrics.json       Time, CPU and memory use of each stage, and counts
+                        of reads, PSL lines, split reads and breakpoints
+    .profile            Written with --profile; cProfile stats of the Python
+                        stages, readable with python -m pstats
     '''
     args = { 'read_1_file_name':read_1_fastq_file,
              'read_2_file_name':read_2_fastq_file,
              'reference_sequence':reference_sequence,
+             'contig':contig,
              'output_prefix':output_prefix,
-             'length':length }
-    _find_breakpoints(**args)
+             'length':length,
+             'threads':threads,
+             'blat_chunks':blat_chunks,
+             'blat_jobs':blat_jobs,
+             'stream_fasta':stream_fasta,
+             'prescreen':prescreen,
+             'prescreen_mismatches':prescreen_mismatches,
+             'aligned_bases':aligned_bases,
+             'alignment_cache':alignment_cache,
+             'blat_cache':blat_cache,
+             'blat_cache_size':blat_cache_size,
+             'aligner':aligner,
+             'collapse_duplicates':collapse_duplicates,
+             'profile':profile }
+    try:
+        _find_breakpoints(**args)
+    except CalledProcessError as error:
+        sys.stderr.write('{} exited with status {}\n'.format(error.cmd[0], error.returncode))
+        sys.exit(error.returncode)
+
+@main.command()
+@click.option('--length', type=int, help='Minimum required alignment length, default = 25',
+              default=25)
+@click.option('--contig', type=str, default=None,
+              help='Name of the sequence to use when the reference FASTA holds more than one')
+@click.option('--workers', type=int, help='Number of samples run at once, default = 1',
+              default=1)
+@click.option('--blat-chunks', type=int, help='Number of pieces each read FASTA is split into for BLAT, default = 1',
+              default=1)
+@click.option('--blat-jobs', type=int, help='Maximum number of concurrent BLAT processes per sample, default = 2',
+              default=2)
+@click.option('--stream-fasta', is_flag=True,
+              help='Stream reads to BLAT through named pipes instead of writing FASTA files')
+@click.option('--prescreen', is_flag=True,
+              help='Skip read pairs whose mates both align contiguously to the reference')
+@click.option('--prescreen-mismatches', type=int,
+              help='Mismatches allowed in a contiguous prescreen match, default = 0', default=0)
+@click.option('--alignment-cache', is_flag=True,
+              help='Save parsed split-read alignments for rescan-breakpoints')
+@click.option('--blat-cache', type=str, default=None,
+              help='Directory of cached BLAT results to reuse and add to')
+@click.option('--blat-cache-size', type=float, default=50,
+              help='Maximum size of the BLAT cache in GB, default = 50')
+@click.option('--aligner', type=click.Choice(['blat', 'kmer']), default='blat',
+              help='Align reads with BLAT or with the built-in k-mer aligner, default = blat')
+@click.option('--collapse-duplicates', is_flag=True,
+              help='Align each distinct read pair once, counting its copies')
+@click.argument('sample_sheet', type=str)
+@click.argument('reference_sequence', type=str)
+@click.argument('output_directory', type=str)
+def find_breakpoints_batch(sample_sheet, reference_sequence, output_directory,
+                           length, contig, workers, blat_chunks, blat_jobs, stream_fasta,
+                           prescreen, prescreen_mismatches, alignment_cache,
+                           blat_cache, blat_cache_size, aligner, collapse_duplicates):
+    '''
+    Identify breakpoints in many samples.
+
+    Given a sample sheet and FASTA reference sequence, run find_breakpoints
+    on every sample and combine the results. The sample sheet must contain
+    three tab-separated columns with no header line: the Read 1 FASTQ file,
+    the Read 2 FASTQ file and the sample name. The padded reference and its
+    indexes are prepared once for all samples, and a sample that fails does
+    not stop the others.
+
+    The files find_breakpoints writes for a sample, with --aligned-bases,
+    are named [output_directory]/[sample name].*. The output directory
+    also receives:
+
+    samples.txt          Sample names with ok or failed, and the error
+    breakpoint_list.txt  List of breakpoint files of finished samples
+    breakpoints.txt      Output of compile_breakpoint_results on that list
+    aligned_bases.txt    Sample names and aligned base counts
+    '''
+    args = { 'length':length,
+             'contig':contig,
+             'workers':workers,
+             'blat_chunks':blat_chunks,
+             'blat_jobs':blat_jobs,
+             'stream_fasta':stream_fasta,
+             'prescreen':prescreen,
+             'prescreen_mismatches':prescreen_mismatches,
+             'alignment_cache':alignment_cache,
+             'blat_cache':blat_cache,
+             'blat_cache_size':blat_cache_size,
+             'aligner':aligner,
+             'collapse_duplicates':collapse_duplicates }
+    failed = _find_breakpoints_batch(sample_sheet, reference_sequence, output_directory, **args)
+    if failed:
+        sys.stderr.write('{} of the samples failed: {}\n'.format(len(failed), ', '.join(failed)))
+        sys.exit(1)
 
 @main.command()
+@click.option('--length', type=int, help='Minimum required alignment length, default = 25',
+              default=25)
+@click.option('--contig', type=str, default=None,
+              help='Name of the sequence to use when the reference FASTA holds more than one')
+@click.option('--threads', type=int, help='Number of processes for breakpoint detection, default = 1',
+              default=1)
+@click.option('--profile', is_flag=True,
+              help='Write cProfile stats of the Python stages to [output_prefix].profile')
+@click.argument('input_prefix', type=str)
+@click.argument('reference_sequence', type=str)
+@click.argument('output_prefix', type=str)
+def rescan_breakpoints(input_prefix, reference_sequence, output_prefix,
+                       length, contig, threads, profile):
+    '''
+    Identify breakpoints again from existing alignments.
+
+    Given the output prefix of an earlier find_breakpoints run and the
+    FASTA reference sequence used, identify breakpoints again without
+    running blat, e.g. with a different --length. The table is written to
+    [output_prefix].breakpoints.txt, and stage metrics to
+    [output_prefix].metrics.json.
+
+    Parsed alignments are read from [input_prefix].alignments, as saved by
+    find_breakpoints --alignment-cache. If it is missing or was built from
+    different PSL files or reference, the PSL files are parsed again and
+    the cache is rewritten.
+    '''
+    args = { 'input_prefix':input_prefix,
+             'reference_sequence':reference_sequence,
+             'contig':contig,
+             'output_prefix':output_prefix,
+             'length':length,
+             'threads':threads,
+             'profile':profile }
+    _rescan_breakpoints(**args)
+
+@main.command()
+@click.option('--depths', type=str, default='1000,10000',
+              help='Comma-separated numbers of simulated read pairs, default = 1000,10000')
+@click.option('--seed', type=int, help='Seed of the read simulator, default = 1', default=1)
+@click.option('--threads', type=int, help='Number of processes for breakpoint detection, default = 1',
+              default=1)
+@click.option('--blat-chunks', type=int, help='Number of pieces each read FASTA is split into for BLAT, default = 1',
+              default=1)
+@click.option('--stream-fasta', is_flag=True,
+              help='Stream reads to BLAT through named pipes instead of writing FASTA files')
+@click.option('--prescreen', is_flag=True,
+              help='Skip read pairs whose mates both align contiguously to the reference')
+@click.option('--aligner', type=click.Choice(['blat', 'kmer']), default='blat',
+              help='Align reads with BLAT or with the built-in k-mer aligner, default = blat')
+@click.option('--multi-hits', type=int, default=0,
+              help='Extra hits simulated for every aligned read, default = 0')
+@click.option('--breakpoint-sets', type=str, default=None,
+              help='Comma-separated sizes of simulated breakpoint tables to time merging on')
+@click.option('--aligned-base-reads', type=str, default=None,
+              help='Comma-separated numbers of simulated aligned read pairs to time get-aligned-bases on')
+@click.option('--record', type=str, default=None,
+              help='Directory to save outputs to as golden files')
+@click.option('--golden', type=str, default=None,
+              help='Directory of golden files to compare outputs with')
+@click.argument('output_directory', type=str)
+def benchmark(output_directory, depths, seed, threads, blat_chunks, stream_fasta,
+              prescreen, aligner, multi_hits, breakpoint_sets, aligned_base_reads, record, golden):
+
+    '''
+    Time find-breakpoints on simulated reads.
+
+    For each depth, simulate read pairs from a circular mtDNA-sized
+    reference carrying known deletions, including one across the origin
+    and ones between direct repeats, and run find-breakpoints and
+    get-aligned-bases on them. BLAT is replaced by a stand-in that returns
+    the simulated alignments, so runs are deterministic and need no BLAT
+    install; with --aligner kmer, the built-in aligner aligns the
+    simulated reads instead. Each depth gets a subdirectory of output_directory named
+    seed_[seed].pairs_[depth].
+
+    --multi-hits gives every aligned read that many more hits, spurious
+    split alignments and repeats of them, to time alignment parsing and
+    deduplication on reads with many hits. Subdirectories are then named
+    seed_[seed].pairs_[depth].hits_[multi_hits].
+
+    --breakpoint-sets times the merging of breakpoints shifted through
+    direct repeats on simulated breakpoint tables of each given size,
+    without reads, and writes breakpoint_sets.txt in output_directory.
+    --aligned-base-reads times get-aligned-bases on simulated PSL files of
+    each given number of read pairs, in subdirectories named
+    seed_[seed].reads_[reads], and writes aligned_base_reads.txt. --depths
+    may be given as an empty string to run only these.
+
+    The time, CPU and memory use of every stage are written to
+    benchmark.txt in output_directory. With --record, the breakpoints
+    table and aligned base count of each depth are saved as golden files;
+    with --golden, they are compared with saved ones, and the command
+    exits with an error if any differ.
+    '''
+
+    args = { 'threads':threads,
+             'blat_chunks':blat_chunks,
+             'stream_fasta':stream_fasta,
+             'prescreen':prescreen,
+             'aligner':aligner }
+    mismatches = _run_benchmark(
+        output_directory, [int(depth) for depth in depths.split(',') if depth],
+        seed, record, golden, multi_hits, **args)
+    if breakpoint_sets:
+        _run_breakpoint_sets(
+            output_directory, [int(size) for size in breakpoint_sets.split(',')], seed)
+    if aligned_base_reads:
+        _run_aligned_bases(
+            output_directory, [int(reads) for reads in aligned_base_reads.split(',')], seed)
+    if mismatches:
+        sys.stderr.write('Outputs do not match golden files: {}\n'.format(', '.join(mismatches)))
+        sys.exit(1)
+
+@main.command()
+@click.option('--order', type=click.Choice(['total', 'position']), default='total',
+              help='Sort rows by total count across files or by start and end, default = total')
+@click.option('--sparse', is_flag=True,
+              help='Write one line per non-zero count instead of a table')
+@click.option('--top', type=int, default=None,
+              help='Only write the breakpoints with the highest total counts')
+@click.option('--compression', type=click.Choice(['gzip', 'zstd']), default=None,
+              help='Compress the table on the fly with gzip or zstd')
+@click.option('--output-format', type=click.Choice(['tsv', 'npy']), default='tsv',
+              help='Write a tab-delimited table or a directory of .npy columns, default = tsv')
 @click.argument('list_file_name', type=str)
 @click.argument('output_file_name', type=str)
-def compile_breakpoint_results(list_file_name, output_file_name):
+def compile_breakpoint_results(list_file_name, output_file_name, order, sparse, top,
+                               compression, output_format):
 
     '''
     Combine results from multiple samples.
@@ -60,14 +349,72 @@ def compile_breakpoint_results(list_file_name, output_file_name):
     should identify the name of a breakpoint file and entries in
     column 2 should specify the corresponding name to be written to
     the header line in the output file.
+
+    With --order position, breakpoint files are merged as they are read,
+    so memory does not grow with the number of files or breakpoints. With
+    --top, only that many rows with the highest totals are kept while
+    merging. With --sparse, the output has columns Start, End, Sample and
+    Count, with a line for each non-zero count.
+
+    With --output-format npy, output_file_name is a directory holding the
+    same table as NumPy .npy columns, which can be memory-mapped:
+    samples.txt, start.npy, end.npy and counts.npy (a row per breakpoint
+    and a column per file), or with --sparse start.npy, end.npy,
+    sample.npy and count.npy (a row per non-zero count).
+    '''
+
+    check_output_options(compression, output_format)
+    _compile_breakpoints(list_file_name, output_file_name, order, sparse, top,
+                         compression, output_format)
+
+@main.command()
+@click.argument('store_directory', type=str)
+@click.argument('list_file_name', type=str)
+def cohort_append(store_directory, list_file_name):
+
+    '''
+    Add samples to a cohort store.
+
+    Given a cohort store directory (created if it does not exist) and a
+    list of breakpoint files in the compile_breakpoint_results format, add
+    the counts of each file to the store under its name. Only the new
+    files are read; samples already in the store are not read again. A
+    name already in the store is an error.
     '''
 
-    _compile_breakpoints(list_file_name, output_file_name)
+    _append_samples(store_directory, list_file_name)
 
 @main.command()
+@click.option('--sparse', is_flag=True,
+              help='Write one line per non-zero count instead of a table')
+@click.option('--compression', type=click.Choice(['gzip', 'zstd']), default=None,
+              help='Compress the table on the fly with gzip or zstd')
+@click.option('--output-format', type=click.Choice(['tsv', 'npy']), default='tsv',
+              help='Write a tab-delimited table or a directory of .npy columns, default = tsv')
+@click.argument('store_directory', type=str)
+@click.argument('output_file_name', type=str)
+def cohort_export(store_directory, output_file_name, sparse, compression, output_format):
+
+    '''
+    Write the breakpoint table of a cohort store.
+
+    Given a cohort store directory built with cohort_append, write the
+    same composite table compile_breakpoint_results would write for all of
+    its samples, in the order they were added. --sparse, --compression and
+    --output-format are as in compile_breakpoint_results.
+    '''
+
+    check_output_options(compression, output_format)
+    _export_cohort(store_directory, output_file_name, sparse, compression, output_format)
+
+@main.command()
+@click.option('--coverage', type=click.Choice(['bedgraph', 'npy']),
+              help='Also write per-position read depth as a bedGraph or NumPy .npy track')
+@click.option('--contig', type=str, default=None,
+              help='Name of the sequence to use when the reference FASTA holds more than one')
 @click.argument('input_file_prefix', type=str)
 @click.argument('reference_sequence', type=str)
-def get_aligned_bases(input_file_prefix, reference_sequence):
+def get_aligned_bases(input_file_prefix, reference_sequence, coverage, contig):
 
     '''
     Count bases aligned by find_breakpoints.
@@ -79,9 +426,14 @@ def get_aligned_bases(input_file_prefix, reference_sequence):
     samples to be easily combined, this output file utlizes a two-column
     tab-delimited format where the first contains the input file prefix and
     the second contains the count itself.
+
+    With --coverage, the read depth at each reference position is also
+    written to [input_prefix].coverage.bedGraph or
+    [input_prefix].coverage.npy. Depth counts each read once per position,
+    so the track sums to the aligned base count from the PSL files.
     '''
 
-    _get_aligned_bases(input_file_prefix, reference_sequence)
+    _get_aligned_bases(input_file_prefix, reference_sequence, coverage, contig)
 
 if __name__ == "__main__":
     main()
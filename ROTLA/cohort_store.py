@@ -0,0 +1,131 @@
+import fcntl
+import os
+
+from compile_breakpoint_results import read_list_file, sort_by_totals, write_rows
+from output import BUFFER_SIZE
+
+
+def read_lines(file_name, size=None):
+    # Complete lines of a file, up to size bytes if given
+    if not os.path.exists(file_name):
+        return
+
+    position = 0
+    with open(file_name) as f:
+        for line in f:
+            position += len(line)
+            if not line.endswith('\n') or (size is not None and position > size):
+                return
+            yield line
+
+
+class CohortStore(object):
+    # Breakpoint counts of a growing cohort, kept as three append-only
+    # tab-delimited files in a directory:
+    #
+    #   breakpoints.txt  start and end of each row, in order of first use
+    #   counts.txt       row, sample index and count for each sample line
+    #   samples.txt      sample name, then the sizes of the two files above
+    #                    once that sample was written
+    #
+    # A sample counts only once its line in samples.txt is complete. Readers
+    # stop at the sizes it records, and an append first cuts off anything
+    # written after them, so an interrupted append leaves the store as it
+    # was.
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.breakpoints_fn = os.path.join(directory, 'breakpoints.txt')
+        self.counts_fn = os.path.join(directory, 'counts.txt')
+        self.samples_fn = os.path.join(directory, 'samples.txt')
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.samples = []
+        self.sizes = {
+            self.breakpoints_fn: 0,
+            self.counts_fn: 0,
+            self.samples_fn: 0,
+        }
+        for line in read_lines(self.samples_fn):
+            file_id, breakpoints_size, counts_size = line.rstrip('\n').split('\t')
+            self.samples.append(file_id)
+            self.sizes[self.breakpoints_fn] = int(breakpoints_size)
+            self.sizes[self.counts_fn] = int(counts_size)
+            self.sizes[self.samples_fn] += len(line)
+
+        self.rows = dict()
+        self.breakpoints = []
+        for line in read_lines(self.breakpoints_fn, self.sizes[self.breakpoints_fn]):
+            breakpoint = tuple(line.rstrip('\n').split('\t'))
+            self.rows[breakpoint] = len(self.breakpoints)
+            self.breakpoints.append(breakpoint)
+
+    def addSample(self, file_name, file_id):
+        # Append one breakpoints file, touching only its own lines and the
+        # rows of breakpoints not seen before
+        if file_id in self.samples:
+            raise StandardError('Sample {} is already in {}.'.format(file_id, self.directory))
+        sample_index = len(self.samples)
+
+        for store_fn, size in self.sizes.items():
+            with open(store_fn, 'a') as f:
+                f.truncate(size)
+
+        with open(file_name) as f, \
+                open(self.breakpoints_fn, 'a', BUFFER_SIZE) as BREAKPOINTS, \
+                open(self.counts_fn, 'a', BUFFER_SIZE) as COUNTS:
+            next(f)
+            for line in f:
+                breakpoint_0, breakpoint_1, count = line.strip().split('\t')
+                breakpoint = (breakpoint_0, breakpoint_1)
+
+                if breakpoint not in self.rows:
+                    self.rows[breakpoint] = len(self.breakpoints)
+                    self.breakpoints.append(breakpoint)
+                    BREAKPOINTS.write('{}\t{}\n'.format(breakpoint_0, breakpoint_1))
+                COUNTS.write('{}\t{}\t{}\n'.format(self.rows[breakpoint], sample_index, int(count)))
+
+        self.sizes[self.breakpoints_fn] = os.path.getsize(self.breakpoints_fn)
+        self.sizes[self.counts_fn] = os.path.getsize(self.counts_fn)
+        line = '{}\t{}\t{}\n'.format(file_id, self.sizes[self.breakpoints_fn], self.sizes[self.counts_fn])
+        with open(self.samples_fn, 'a') as SAMPLES:
+            SAMPLES.write(line)
+        self.sizes[self.samples_fn] += len(line)
+        self.samples.append(file_id)
+
+    def export(self, output_file, sparse=False, compression=None, output_format='tsv'):
+        # Same table as compile_breakpoints on the samples in the order they
+        # were added
+        counts = dict()
+        for line in read_lines(self.counts_fn, self.sizes[self.counts_fn]):
+            row, sample_index, count = line.split('\t')
+            counts.setdefault(int(row), dict())[int(sample_index)] = int(count)
+
+        # Rows in order of first use give the dict compile_breakpoints builds
+        breakpoint_dict = dict()
+        for row, breakpoint in enumerate(self.breakpoints):
+            if row in counts:
+                breakpoint_dict[breakpoint] = counts[row]
+
+        write_rows(sort_by_totals(breakpoint_dict), self.samples, output_file, sparse, compression, output_format)
+
+
+def append_samples(store_directory, input_files):
+    # Add every breakpoints file of a compile_breakpoints list file to a
+    # cohort store, holding a lock so appends from several runs take turns
+    if not os.path.isdir(store_directory):
+        os.makedirs(store_directory)
+
+    with open(os.path.join(store_directory, 'lock'), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        store = CohortStore(store_directory)
+        for file_name, file_id in read_list_file(input_files):
+            store.addSample(file_name, file_id)
+
+
+def export_cohort(store_directory, output_file, sparse=False, compression=None, output_format='tsv'):
+
+    CohortStore(store_directory).export(output_file, sparse, compression, output_format)
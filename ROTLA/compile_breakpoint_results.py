@@ -1,57 +1,187 @@
 #!/usr/bin/env python
 
+import heapq
+import os
+import resource
 import sys
 
-def compile_breakpoints(input_files, output_file):
+from itertools import groupby
+
+from metrics import Metrics
+from output import open_output, write_columns, write_lines
+
+def read_list_file(input_files):
+
+    file_list = []
+    with open(input_files) as f:
+        for line in f:
+            file_name, file_id = line.strip().split()
+            file_list.append((file_name, file_id))
+
+    return file_list
+
+def read_breakpoints(file_name, file_index):
+    # Yield ((start, end), file index, count) from a breakpoints file, which
+    # printBreaks writes sorted by start and end
+    last = None
+    with open(file_name) as f:
+        next(f)
+        for line in f:
+            breakpoint_0, breakpoint_1, count = line.strip().split("\t")
+            breakpoint = (int(breakpoint_0), int(breakpoint_1))
+            if last is not None and breakpoint < last:
+                raise StandardError('{} is not sorted by start and end.'.format(file_name))
+            last = breakpoint
+            yield breakpoint, file_index, int(count)
+
+def merge_breakpoints(file_names):
+    # Yield (start, end, [(file index, count), ...]) for every breakpoint in
+    # start and end order, holding one line per file in memory
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and soft < len(file_names) + 16:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    merged = heapq.merge(*[
+        read_breakpoints(file_name, file_index)
+        for file_index, file_name in enumerate(file_names)
+    ])
+    for breakpoint, group in groupby(merged, key=lambda k: k[0]):
+        counts = dict()
+        for _, file_index, count in group:
+            counts[file_index] = count
+        yield breakpoint[0], breakpoint[1], sorted(counts.items())
+
+def write_rows(rows, id_list, output_file, sparse=False, compression=None, output_format='tsv'):
+    # rows holds (start, end, [(file index, count), ...]). The matrix layout
+    # has a column per file with zeros filled in; the sparse layout has a
+    # line per non-zero count. Returns the number of breakpoints written.
+    if output_format == 'npy':
+        return write_table_columns(rows, id_list, output_file, sparse)
+
+    def formatRow(breakpoint_0, breakpoint_1, counts):
+        if sparse:
+            return "".join(
+                "{}\t{}\t{}\t{}\n".format(breakpoint_0, breakpoint_1, id_list[file_index], count)
+                for file_index, count in counts
+            )
+
+        row = ["0"] * len(id_list)
+        for file_index, count in counts:
+            row[file_index] = str(count)
+        return "{}\t{}\t{}\n".format(breakpoint_0, breakpoint_1, "\t".join(row))
+
+    with open_output(output_file, compression) as OUTPUT:
+        if sparse:
+            OUTPUT.write("Start\tEnd\tSample\tCount\n")
+        else:
+            OUTPUT.write("\t" + "".join("\t" + file_id for file_id in id_list) + "\n")
+
+        return write_lines(OUTPUT, (formatRow(*row) for row in rows))
+
+def write_table_columns(rows, id_list, output_directory, sparse=False):
+    # The table of write_rows as .npy columns in output_directory, in the
+    # same row order, with file names in samples.txt. The matrix layout has
+    # start, end and a counts matrix with a column per file; the sparse
+    # layout has start, end, sample (index in samples.txt) and count per
+    # non-zero count. Returns the number of breakpoints written.
+    if not os.path.isdir(output_directory):
+        os.makedirs(output_directory)
+    with open(os.path.join(output_directory, "samples.txt"), "w") as OUTPUT:
+        for file_id in id_list:
+            OUTPUT.write(file_id + "\n")
+
+    written = [0]
+
+    def matrixRows():
+        for breakpoint_0, breakpoint_1, counts in rows:
+            written[0] += 1
+            row = [0] * len(id_list)
+            for file_index, count in counts:
+                row[file_index] = count
+            yield int(breakpoint_0), int(breakpoint_1), row
+
+    def sparseRows():
+        for breakpoint_0, breakpoint_1, counts in rows:
+            written[0] += 1
+            for file_index, count in counts:
+                yield int(breakpoint_0), int(breakpoint_1), file_index, count
+
+    if sparse:
+        write_columns(
+            output_directory,
+            [("start", None), ("end", None), ("sample", None), ("count", None)],
+            sparseRows(),
+        )
+    else:
+        write_columns(
+            output_directory,
+            [("start", None), ("end", None), ("counts", len(id_list))],
+            matrixRows(),
+        )
+
+    return written[0]
+
+def compile_breakpoints(input_files, output_file, order='total', sparse=False, top=None,
+                        compression=None, output_format='tsv'):
+
+    metrics = Metrics('compile-breakpoint-results')
+    metrics_file = os.path.splitext(output_file)[0] + '.metrics.json'
+
+    file_list = read_list_file(input_files)
+    id_list = [file_id for file_name, file_id in file_list]
+    metrics.count('files', len(file_list))
+
+    ## STREAM BREAKPOINTS IN POSITION ORDER, KEEPING THE TOP TOTALS IF ASKED
+    if order == 'position' or top is not None:
+        with metrics.stage('merge_and_write'):
+            rows = merge_breakpoints([file_name for file_name, file_id in file_list])
+            if top is not None:
+                rows = heapq.nlargest(top, rows, key=lambda k: sum(count for _, count in k[2]))
+            metrics.count('breakpoints_written', write_rows(
+                rows, id_list, output_file, sparse, compression, output_format))
+        metrics.write(metrics_file)
+        return
 
     breakpoint_dict = dict()
-    id_list = []
-    totals_dict = dict()
 
-    def getBreaks(file_name, file_id):
+    def getBreaks(file_name, file_index):
         with open(file_name) as f:
             next(f)
             for line in f:
                 breakpoint_0, breakpoint_1, count = line.strip().split("\t")
                 count = int(count)
                 if (breakpoint_0, breakpoint_1) in breakpoint_dict:
-                    breakpoint_dict[(breakpoint_0, breakpoint_1)][file_id] = count
+                    breakpoint_dict[(breakpoint_0, breakpoint_1)][file_index] = count
                 else:
-                    breakpoint_dict[(breakpoint_0, breakpoint_1)] = {file_id:count}
+                    breakpoint_dict[(breakpoint_0, breakpoint_1)] = {file_index:count}
 
-    with open(input_files) as file_list:
-        for line in file_list:
-            file_name, file_id = line.strip().split()
-            getBreaks(file_name, file_id)
-            id_list.append(file_id)
+    with metrics.stage('read_breakpoints'):
+        for file_index, (file_name, file_id) in enumerate(file_list):
+            getBreaks(file_name, file_index)
 
-    ## ADD ZEROES
-    for breakpoint in breakpoint_dict:
-        for file_id in id_list:
-            if file_id not in breakpoint_dict[breakpoint]:
-                breakpoint_dict[breakpoint][file_id] = 0
+    with metrics.stage('sort_and_write'):
+        written = write_rows(
+            sort_by_totals(breakpoint_dict), id_list, output_file, sparse, compression, output_format)
+    metrics.count('breakpoints_written', written)
+    metrics.write(metrics_file)
+
+def sort_by_totals(breakpoint_dict):
+    # Rows of breakpoint_dict, which maps (start, end) to {file index:
+    # count}, highest total first. Ties keep the dict's iteration order, so
+    # building the dict the same way gives the same table.
+    totals_dict = dict()
 
     ## GET TOTALS
     for breakpoint in breakpoint_dict:
-        total = 0
-        for file_id in id_list:
-            total += breakpoint_dict[breakpoint][file_id]
-        totals_dict[breakpoint] = total
+        totals_dict[breakpoint] = sum(breakpoint_dict[breakpoint].values())
 
     ## SORT BREAKPOINT LIST BY TOTALS
     sorted_breakpoint = sorted(totals_dict, key=lambda k: totals_dict[k], reverse=True)
 
-    with open(output_file, "w") as OUTPUT:
-        OUTPUT.write("\t")
-        for file_id in id_list:
-            OUTPUT.write("\t" + file_id)
-        OUTPUT.write("\n")
-
-        for breakpoint in sorted_breakpoint:
-            OUTPUT.write(breakpoint[0] + "\t" + breakpoint[1])
-            for file_id in id_list:
-                OUTPUT.write("\t" + str(breakpoint_dict[breakpoint][file_id]))
-            OUTPUT.write("\n")
+    return (
+        (breakpoint[0], breakpoint[1], sorted(breakpoint_dict[breakpoint].items()))
+        for breakpoint in sorted_breakpoint
+    )
 
 if __name__ == '__main__':
     if len(sys.argv) < 3:
@@ -0,0 +1,44 @@
+import gzip
+import io
+
+from distutils.spawn import find_executable
+from subprocess import Popen, PIPE, CalledProcessError
+
+BUFFER_SIZE = 1 << 20
+
+
+class DecompressionPipe(object):
+    # Lines of a gzip file decompressed by an external process
+
+    def __init__(self, command):
+        self.command = command
+        self.process = Popen(command, stdout=PIPE, bufsize=BUFFER_SIZE)
+
+    def __iter__(self):
+        return iter(self.process.stdout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.process.stdout.close()
+        return_code = self.process.wait()
+
+        # A negative status means the process was stopped by SIGPIPE after
+        # the reader closed early, which is not an error
+        if return_code > 0:
+            raise CalledProcessError(return_code, self.command)
+
+
+def open_gzip(file_name):
+    # Prefer pigz or gzip in a separate process; otherwise at least read
+    # the Python gzip stream through a large buffer
+    for program in ['pigz', 'gzip']:
+        path = find_executable(program)
+        if path:
+            return DecompressionPipe([path, '-dc', file_name])
+
+    return io.BufferedReader(gzip.open(file_name), BUFFER_SIZE)
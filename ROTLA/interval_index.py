@@ -0,0 +1,75 @@
+from bisect import bisect_right
+from collections import defaultdict
+
+
+def last_contained(intervals):
+    # For each (start, end) interval, the highest index of an interval lying
+    # within it (start >= start, end <= end) with different coordinates, or
+    # -1 if there is none.
+    #
+    # Sweep by descending start while a Fenwick tree over end ranks keeps
+    # the highest index seen for each end, so every lookup is O(log n).
+    ends = sorted(set(end for start, end in intervals))
+    end_rank = dict((end, rank + 1) for rank, end in enumerate(ends))
+    tree = [-1] * (len(ends) + 1)
+
+    def update(rank, index):
+        while rank < len(tree):
+            if tree[rank] < index:
+                tree[rank] = index
+            rank += rank & -rank
+
+    def query(rank):
+        highest = -1
+        while rank > 0:
+            if tree[rank] > highest:
+                highest = tree[rank]
+            rank -= rank & -rank
+        return highest
+
+    order = sorted(
+        range(len(intervals)),
+        key=lambda k: (-intervals[k][0], intervals[k][1]),
+    )
+    contained = [-1] * len(intervals)
+
+    # Identical intervals are looked up before any of them is added
+    group_start = 0
+    while group_start < len(order):
+        group_end = group_start
+        while group_end < len(order) and \
+                intervals[order[group_end]] == intervals[order[group_start]]:
+            group_end += 1
+
+        for k in order[group_start:group_end]:
+            contained[k] = query(end_rank[intervals[k][1]])
+        for k in order[group_start:group_end]:
+            update(end_rank[intervals[k][1]], k)
+
+        group_start = group_end
+
+    return contained
+
+
+def shifted_overlaps(intervals):
+    # For each (start, end) interval, the indices of intervals with the same
+    # span (end - start) whose start falls strictly between its start and
+    # end, ordered by start. These are the only candidates for being the
+    # same deletion shifted right through a direct repeat.
+    spans = defaultdict(list)
+    for index, (start, end) in enumerate(intervals):
+        spans[end - start].append((start, index))
+
+    overlaps = [[] for interval in intervals]
+    for span, members in spans.items():
+        members.sort()
+        starts = [start for start, index in members]
+
+        for position, (start, index) in enumerate(members):
+            last = bisect_right(starts, start + span - 1)
+            overlaps[index] = [
+                other for other_start, other in members[position + 1:last]
+                if other_start > start
+            ]
+
+    return overlaps
@@ -0,0 +1,294 @@
+import string
+
+import numpy
+
+COMPLEMENT = string.maketrans('ACGTacgt', 'TGCAtgca')
+
+# 2-bit codes of bases; anything else is 4 and ends a k-mer
+ENCODING = numpy.full(256, 4, dtype=numpy.int64)
+for code, bases in enumerate(['Aa', 'Cc', 'Gg', 'Tt']):
+    for base in bases:
+        ENCODING[ord(base)] = code
+
+PSL_HEADER = (
+    'psLayout version 3\n'
+    '\n'
+    'match\tmis- \trep. \tN\'s\tQ gap\tQ gap\tT gap\tT gap\tstrand\tQ        \tQ   \tQ    \tQ  \tT        \tT   \tT    \tT  \tblock\tblockSizes \tqStarts\t tStarts\n'
+    '     \tmatch\tmatch\t   \tcount\tbases\tcount\tbases\t      \tname     \tsize\tstart\tend\tname     \tsize\tstart\tend\tcount\n'
+    '---------------------------------------------------------------------------------------------------------------------------------------------------------------\n'
+)
+
+# Read pairs sent to a pool worker at once
+ALIGN_BATCH_SIZE = 2000
+
+# Length of the k-mer prefixes indexed for lookups
+PREFIX_LENGTH = 10
+
+# Segments of one strand of a read considered for chaining
+MAX_SEGMENTS = 16
+
+
+def kmer_codes(sequence, k):
+    # Integer code of the k-mer starting at each position of sequence, or
+    # -1 where the k-mer holds a base other than A, C, G or T
+    bases = ENCODING[numpy.frombuffer(sequence, dtype=numpy.uint8)]
+    windows = len(bases) - k + 1
+    if windows < 1:
+        return numpy.zeros(0, dtype=numpy.int64)
+
+    codes = numpy.zeros(windows, dtype=numpy.int64)
+    for j in range(k):
+        codes = (codes << 2) | (bases[j:j + windows] & 3)
+
+    invalid = numpy.concatenate([[0], numpy.cumsum(bases == 4)])
+    codes[invalid[k:] - invalid[:windows] > 0] = -1
+
+    return codes
+
+
+class KmerAligner(object):
+    # Split-read aligner for small circular references, built in as an
+    # alternative to BLAT. Exact k-mer seeds against the padded reference
+    # are grouped by diagonal into ungapped segments, which are extended
+    # across mismatches and chained into hits of at most max_blocks blocks
+    # with increasing query and padded reference positions, so a deletion,
+    # including one across the origin, gives a split hit as BLAT does.
+    # Hits are returned as PSL lines against the padded reference.
+
+    def __init__(self, ref_seq, k=12, min_block=20, max_blocks=3, min_score=30):
+        self.k = k
+        self.min_block = min_block
+        self.max_blocks = max_blocks
+        self.min_score = min_score
+
+        self.ref_length = len(ref_seq)
+        self.padded_seq = (ref_seq + ref_seq).upper()
+
+        # K-mers starting in the first copy, which include those across the
+        # origin, sorted by code, with the first entry of each code prefix
+        codes = kmer_codes(self.padded_seq[:self.ref_length + k - 1], k)
+        positions = numpy.flatnonzero(codes >= 0)
+        order = numpy.argsort(codes[positions], kind='mergesort')
+        self.positions = positions[order]
+        self.codes = codes[positions][order]
+
+        self.prefix_shift = 2 * max(0, k - PREFIX_LENGTH)
+        self.prefix_starts = numpy.searchsorted(
+            self.codes >> self.prefix_shift,
+            numpy.arange(4 ** min(k, PREFIX_LENGTH) + 1),
+        ).astype(numpy.int32)
+
+    def segments(self, queries):
+        # Ungapped segments (query index, q start, q end, t start) of every
+        # query, from runs of seeds on the same diagonal. Diagonals are
+        # taken modulo the reference length, so both copies in the padded
+        # reference give one segment, placed in the first copy it fits.
+        if not queries:
+            return []
+
+        starts = numpy.cumsum([0] + [len(query) + 1 for query in queries])
+        codes = kmer_codes('N'.join(queries), self.k)
+        offsets = numpy.flatnonzero(codes >= 0)
+        codes = codes[offsets]
+
+        # Reference k-mers sharing each query k-mer's prefix, kept where the
+        # whole code matches
+        prefixes = codes >> self.prefix_shift
+        left = self.prefix_starts[prefixes]
+        counts = self.prefix_starts[prefixes + 1] - left
+        hits = numpy.repeat(left - numpy.cumsum(counts) + counts, counts) + numpy.arange(counts.sum())
+        matches = self.codes[hits] == numpy.repeat(codes, counts)
+        hits = hits[matches]
+        offsets = numpy.repeat(offsets, counts)[matches]
+        if not len(hits):
+            return []
+
+        query = numpy.searchsorted(starts, offsets, 'right') - 1
+        q = offsets - starts[query]
+        diagonal = (self.positions[hits] - q) % self.ref_length
+
+        max_length = max(len(query) for query in queries) + 1
+        order = numpy.argsort((query * self.ref_length + diagonal) * max_length + q)
+        query, q, diagonal = query[order], q[order], diagonal[order]
+
+        # A run ends where the query or diagonal changes, or at a gap too
+        # long to be a couple of mismatches
+        new_run = numpy.ones(len(q), dtype=bool)
+        new_run[1:] = (
+            (query[1:] != query[:-1]) |
+            (diagonal[1:] != diagonal[:-1]) |
+            (q[1:] - q[:-1] > 2 * self.k)
+        )
+        first = numpy.flatnonzero(new_run)
+        last = numpy.append(first[1:], len(q)) - 1
+
+        return zip(
+            query[first].tolist(),
+            q[first].tolist(),
+            (q[last] + self.k).tolist(),
+            (diagonal[first] + q[first]).tolist(),
+        )
+
+    def extend(self, query, q_start, q_end, t_start):
+        # Extend a segment at both ends until mismatches outweigh matches,
+        # scoring +1 per match and -3 per mismatch
+        target = self.padded_seq
+        offset = t_start - q_start
+
+        bounds = []
+        for position, step, limit in [
+            (q_start - 1, -1, max(-1, -offset - 1)),
+            (q_end, 1, min(len(query), len(target) - offset)),
+        ]:
+            score = best = 0
+            end = position - step
+            while position != limit:
+                score += 1 if query[position] == target[position + offset] else -3
+                if score > best:
+                    best = score
+                    end = position
+                elif score < best - 6:
+                    break
+                position += step
+            bounds.append(end)
+
+        return bounds[0], bounds[1] + 1, bounds[0] + offset
+
+    def mismatches(self, query, q_start, q_end, t_start):
+        target = self.padded_seq[t_start:t_start + q_end - q_start]
+        query = query[q_start:q_end]
+        if query == target:
+            return 0
+
+        return sum(1 for a, b in zip(query, target) if a != b)
+
+    def chain(self, query, segments):
+        # Highest-scoring chain of segments, trimming each one where it
+        # overlaps the last on the query and lifting it into the second
+        # copy of the reference if it would otherwise start before the end
+        # of the last on the target. Returns (score, blocks) with blocks as
+        # (segment index, q start, t start, size, mismatches).
+        best = [(0, [])]
+
+        def add_blocks(blocks, score, start):
+            if score > best[0][0]:
+                best[0] = (score, list(blocks))
+            if len(blocks) == self.max_blocks:
+                return
+
+            for index in range(start, len(segments)):
+                q_start, q_end, t_start, mismatches = segments[index]
+                gaps = 0
+                if blocks:
+                    last_q, last_t, last_size = blocks[-1][1:4]
+                    trim = max(0, last_q + last_size - q_start)
+                    if q_end - q_start - trim < self.min_block:
+                        continue
+                    q_start += trim
+                    t_start += trim
+                    if t_start < last_t + last_size:
+                        t_start += self.ref_length
+                    if t_start + q_end - q_start > len(self.padded_seq):
+                        continue
+                    if trim:
+                        mismatches = self.mismatches(query, q_start, q_end, t_start)
+                    gaps = int(q_start > last_q + last_size) + int(t_start > last_t + last_size)
+
+                size = q_end - q_start
+                blocks.append((index, q_start, t_start, size, mismatches))
+                add_blocks(blocks, score + size - 2 * mismatches - gaps, index + 1)
+                blocks.pop()
+
+        add_blocks([], 0, 0)
+
+        return best[0]
+
+    def pslLine(self, name, strand, query_length, blocks):
+        sizes = [size for q, t, size, mismatches in blocks]
+        mismatches = sum(block[3] for block in blocks)
+        q_inserts = [b[0] - a[0] - a[2] for a, b in zip(blocks, blocks[1:]) if b[0] > a[0] + a[2]]
+        t_inserts = [b[1] - a[1] - a[2] for a, b in zip(blocks, blocks[1:]) if b[1] > a[1] + a[2]]
+        q_start = blocks[0][0]
+        q_end = blocks[-1][0] + blocks[-1][2]
+        if strand == '-':
+            q_start, q_end = query_length - q_end, query_length - q_start
+
+        return '\t'.join(str(column) for column in [
+            sum(sizes) - mismatches, mismatches, 0, 0,
+            len(q_inserts), sum(q_inserts), len(t_inserts), sum(t_inserts),
+            strand, name, query_length, q_start, q_end,
+            'Padded', len(self.padded_seq), blocks[0][1], blocks[-1][1] + blocks[-1][2],
+            len(blocks),
+            ''.join('{},'.format(size) for size in sizes),
+            ''.join('{},'.format(block[0]) for block in blocks),
+            ''.join('{},'.format(block[1]) for block in blocks),
+        ]) + '\n'
+
+    def alignQuery(self, name, query, strand, segments):
+        # PSL lines of one strand of a read: its best chain, then any other
+        # segment scoring as a hit on its own
+        extended = set()
+        for q_start, q_end, t_start in segments:
+            q_start, q_end, t_start = self.extend(query, q_start, q_end, t_start)
+            if q_end - q_start >= self.min_block:
+                extended.add((q_start, q_end, t_start))
+
+        # Low-complexity reads can seed many diagonals; chain the longest
+        extended = sorted(
+            (q_start, q_end, t_start, self.mismatches(query, q_start, q_end, t_start))
+            for q_start, q_end, t_start in
+            sorted(extended, key=lambda k: k[0] - k[1])[:MAX_SEGMENTS]
+        )
+
+        score, blocks = self.chain(query, extended)
+        if score < self.min_score:
+            return []
+        lines = [self.pslLine(name, strand, len(query), [block[1:] for block in blocks])]
+
+        chained = set(block[0] for block in blocks)
+        for index, (q_start, q_end, t_start, mismatches) in enumerate(extended):
+            if index not in chained and q_end - q_start - 2 * mismatches >= self.min_score:
+                lines.append(self.pslLine(
+                    name, strand, len(query), [(q_start, t_start, q_end - q_start, mismatches)]))
+
+        return lines
+
+    def align(self, records):
+        # PSL lines of each (name, sequence) record, in order
+        if not records:
+            return []
+
+        queries = []
+        for name, sequence in records:
+            queries.append(sequence.upper())
+            queries.append(sequence.upper().translate(COMPLEMENT)[::-1])
+
+        segments = [[] for query in queries]
+        for query, q_start, q_end, t_start in self.segments(queries):
+            segments[query].append((q_start, q_end, t_start))
+
+        alignments = []
+        for i, (name, sequence) in enumerate(records):
+            lines = []
+            for strand, query in [('+', 2 * i), ('-', 2 * i + 1)]:
+                lines.extend(self.alignQuery(name, queries[query], strand, segments[query]))
+            alignments.append(''.join(lines))
+
+        return alignments
+
+
+def init_align_worker(aligner):
+    global worker_aligner
+    worker_aligner = aligner
+
+
+def align_batch(batch):
+    # PSL text of the read 1 and the read 2 records of a batch of pairs
+    psl_text = []
+    for read in range(2):
+        psl_text.append(''.join(worker_aligner.align([
+            (records[read][0].split()[0], records[read][1].strip())
+            for records in batch if records[read]
+        ])))
+
+    return psl_text
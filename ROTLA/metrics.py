@@ -0,0 +1,71 @@
+import cProfile
+import json
+import os
+import resource
+import time
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class Metrics(object):
+    # Wall time, CPU time and peak memory of each stage of a command, and
+    # counters set along the way. With a profile file, stages that run
+    # Python code are also profiled, and their combined stats are dumped
+    # there in pstats format.
+
+    def __init__(self, command, profile_file=None):
+        self.command = command
+        self.stages = OrderedDict()
+        self.counters = OrderedDict()
+        self.start = time.time()
+
+        self.profile_file = profile_file
+        self.profiler = cProfile.Profile() if profile_file else None
+
+    @contextmanager
+    def stage(self, name, profile=True):
+        # Time the enclosed block. A stage entered again adds to its times.
+        # CPU time of child processes (BLAT, decompression) is kept apart
+        # and only covers children that have exited.
+        times = os.times()
+        wall = time.time()
+        if self.profiler and profile:
+            self.profiler.enable()
+
+        try:
+            yield
+        finally:
+            if self.profiler and profile:
+                self.profiler.disable()
+            end_times = os.times()
+
+            stage = self.stages.setdefault(name, OrderedDict([
+                ('wall_seconds', 0.0),
+                ('cpu_seconds', 0.0),
+                ('child_cpu_seconds', 0.0),
+            ]))
+            for key, value in [
+                ('wall_seconds', time.time() - wall),
+                ('cpu_seconds', end_times[0] + end_times[1] - times[0] - times[1]),
+                ('child_cpu_seconds', end_times[2] + end_times[3] - times[2] - times[3]),
+            ]:
+                stage[key] = round(max(stage[key] + value, 0.0), 6)
+            stage['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            stage['child_peak_rss_kb'] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+    def count(self, name, value):
+        self.counters[name] = value
+
+    def write(self, output_file):
+        with open(output_file, 'w') as OUTPUT:
+            json.dump(OrderedDict([
+                ('command', self.command),
+                ('wall_seconds', round(time.time() - self.start, 6)),
+                ('stages', self.stages),
+                ('counters', self.counters),
+            ]), OUTPUT, indent=2)
+            OUTPUT.write('\n')
+
+        if self.profiler:
+            self.profiler.dump_stats(self.profile_file)
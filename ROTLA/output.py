@@ -0,0 +1,144 @@
+import gzip
+import io
+import os
+
+from array import array
+from distutils.spawn import find_executable
+from itertools import islice
+from subprocess import Popen, PIPE, CalledProcessError
+
+import numpy
+from numpy.lib.format import open_memmap
+
+# Bytes buffered before each write to an output file
+BUFFER_SIZE = 1 << 20
+
+# Rows formatted and written together
+BATCH_SIZE = 10000
+
+# External programs tried in turn for each compression, with their options
+# to compress standard input to standard output
+COMPRESSORS = {
+    'gzip': [('pigz', ['-c']), ('gzip', ['-c'])],
+    'zstd': [('zstd', ['-q', '-c'])],
+}
+
+
+class CompressionPipe(object):
+    # Output file written through an external compressor
+
+    def __init__(self, command, file_name):
+        self.command = command
+        self.output = open(file_name, 'wb')
+        self.process = Popen(command, stdin=PIPE, stdout=self.output, bufsize=BUFFER_SIZE)
+
+    def write(self, data):
+        self.process.stdin.write(data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.process.stdin.close()
+        return_code = self.process.wait()
+        self.output.close()
+
+        if return_code != 0:
+            raise CalledProcessError(return_code, self.command)
+
+
+def open_output(file_name, compression=None):
+    # Output file written through a large buffer, and compressed on the fly
+    # with gzip or zstd if asked. Compression runs in a separate process
+    # when pigz, gzip or zstd is installed; otherwise gzip falls back to the
+    # Python gzip module and zstd to the zstandard package.
+    if compression is None:
+        return open(file_name, 'w', BUFFER_SIZE)
+
+    for program, options in COMPRESSORS[compression]:
+        path = find_executable(program)
+        if path:
+            return CompressionPipe([path] + options, file_name)
+
+    if compression == 'gzip':
+        return io.BufferedWriter(gzip.open(file_name, 'wb'), BUFFER_SIZE)
+
+    try:
+        import zstandard
+    except ImportError:
+        raise StandardError('zstd compression needs the zstd program or the zstandard package.')
+    return io.BufferedWriter(
+        zstandard.ZstdCompressor().stream_writer(open(file_name, 'wb')),
+        BUFFER_SIZE,
+    )
+
+
+def write_lines(OUTPUT, lines, batch_size=BATCH_SIZE):
+    # Write formatted lines batch_size at a time, joined into one string
+    # per write. Returns the number of lines written.
+    lines = iter(lines)
+    written = 0
+
+    while True:
+        batch = list(islice(lines, batch_size))
+        if not batch:
+            return written
+        OUTPUT.write(''.join(batch))
+        written += len(batch)
+
+
+def write_columns(directory, columns, rows, batch_size=BATCH_SIZE):
+    # Write a table of integers as one .npy file per column in directory,
+    # which numpy.load(..., mmap_mode='r') maps without reading it. columns
+    # holds (name, width) pairs: a column of width None is a 1-D array, any
+    # other a 2-D array with width values per table row. rows yields a
+    # tuple of values per table row, with a list for each 2-D column. Rows
+    # are appended in batches to raw files, and each becomes a .npy file
+    # once the number of rows is known. Returns the number of rows.
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    raw_files = [os.path.join(directory, name + '.raw') for name, width in columns]
+
+    rows = iter(rows)
+    written = 0
+    handles = [open(raw_file, 'wb') for raw_file in raw_files]
+    try:
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            for i, ((name, width), handle) in enumerate(zip(columns, handles)):
+                values = array('i')
+                if width is None:
+                    values.extend(row[i] for row in batch)
+                else:
+                    for row in batch:
+                        values.extend(row[i])
+                values.tofile(handle)
+            written += len(batch)
+    finally:
+        for handle in handles:
+            handle.close()
+
+    for (name, width), raw_file in zip(columns, raw_files):
+        shape = (written,) if width is None else (written, width)
+        column_file = os.path.join(directory, name + '.npy')
+
+        # An empty file cannot be mapped
+        if not written or width == 0:
+            numpy.save(column_file, numpy.zeros(shape, dtype=numpy.intc))
+        else:
+            column = open_memmap(column_file, 'w+', numpy.intc, shape)
+            flat = column.reshape(-1)
+            with open(raw_file, 'rb') as f:
+                for start in range(0, flat.size, BUFFER_SIZE):
+                    chunk = numpy.fromfile(f, dtype=numpy.intc, count=BUFFER_SIZE)
+                    flat[start:start + len(chunk)] = chunk
+            column.flush()
+            del flat, column
+        os.remove(raw_file)
+
+    return written
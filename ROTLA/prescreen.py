@@ -0,0 +1,54 @@
+import string
+
+from collections import defaultdict
+
+COMPLEMENT = string.maketrans('ACGTacgt', 'TGCAtgca')
+
+
+class KmerIndex(object):
+    # Positions of every k-mer in the padded reference, used to find reads
+    # that align end to end as a single block and so cannot be split reads
+
+    def __init__(self, ref_seq, k=12):
+        self.k = k
+        self.padded_seq = ref_seq + ref_seq
+
+        self.positions = defaultdict(list)
+        for i in range(len(self.padded_seq) - k + 1):
+            self.positions[self.padded_seq[i:i + k]].append(i)
+
+    def contiguousMatches(self, seq, max_mismatches=0):
+        # Padded-reference blocks (1-based start, end) where the read or its
+        # reverse complement matches end to end with at most max_mismatches
+        # mismatches. Seeds are the first k-mer of max_mismatches + 1
+        # disjoint segments, at least one of which must match exactly.
+        seq = seq.upper()
+        length = len(seq)
+        segment = length // (max_mismatches + 1)
+        if segment < self.k:
+            return set()
+
+        blocks = set()
+        for query in [seq, seq.translate(COMPLEMENT)[::-1]]:
+            starts = set()
+            for offset in range(0, segment * (max_mismatches + 1), segment):
+                for position in self.positions.get(query[offset:offset + self.k], []):
+                    start = position - offset
+                    if start >= 0 and start + length <= len(self.padded_seq):
+                        starts.add(start)
+
+            for start in starts:
+                target = self.padded_seq[start:start + length]
+                if query == target:
+                    blocks.add((start + 1, start + length))
+                elif max_mismatches:
+                    mismatches = 0
+                    for a, b in zip(query, target):
+                        if a != b:
+                            mismatches += 1
+                            if mismatches > max_mismatches:
+                                break
+                    if mismatches <= max_mismatches:
+                        blocks.add((start + 1, start + length))
+
+        return blocks
@@ -0,0 +1,161 @@
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy
+
+from reference_index import ReferenceIndex
+
+# Bump when the files of a saved index or how they are built changes
+INDEX_VERSION = 2
+
+
+def read_fasta(fasta_file):
+    # Yield (name, sequence) for each record, joining its lines once. Lines
+    # before the first header form a record with an empty name.
+    name = None
+    lines = []
+
+    with open(fasta_file) as f:
+        for line in f:
+            if line[0] == ">":
+                if name is not None or lines:
+                    yield name or '', ''.join(lines)
+                name = (line[1:].split() or [''])[0]
+                lines = []
+            else:
+                lines.append(line.strip())
+
+    if name is not None or lines:
+        yield name or '', ''.join(lines)
+
+
+class Reference(object):
+    # The circular sequence breakpoints are called on: one record of the
+    # reference FASTA, upper-cased, with its length, MD5 checksum (as in the
+    # M5 tag of a SAM header) and the repeat tables of its ReferenceIndex.
+    # The index is saved next to the FASTA in a sidecar directory, so later
+    # runs on a sequence with the same checksum and index version load it
+    # instead of rebuilding it.
+
+    def __init__(self, name, sequence, index=None):
+        self.name = name
+        self.sequence = sequence
+        self.length = len(sequence)
+        self.checksum = hashlib.md5(sequence).hexdigest()
+        self.reference_index = index if index is not None else ReferenceIndex(sequence)
+
+    @property
+    def padded_seq(self):
+        return self.sequence + self.sequence
+
+    def writePaddedFASTA(self, output_file):
+        with open(output_file, "w") as OUTPUT:
+            OUTPUT.write("> Padded reference\n")
+            OUTPUT.write(self.padded_seq + "\n")
+
+    @staticmethod
+    def sidecar(fasta_file):
+        return fasta_file + ".rotla_index"
+
+    @staticmethod
+    def sidecarKey(length, checksum):
+        return '{}\t{}\t{}'.format(INDEX_VERSION, length, checksum)
+
+    @staticmethod
+    def parse(fasta_file, contig=None):
+        # Name and upper-cased sequence of one record of the FASTA: the one
+        # named contig, or the only one if contig is not given
+        records = []
+        for name, sequence in read_fasta(fasta_file):
+            if contig is None or name == contig:
+                records.append((name, sequence.upper()))
+            if contig is not None and records:
+                break
+
+        if not records:
+            if contig is None:
+                raise StandardError('FASTA {} contains no sequence.'.format(fasta_file))
+            raise StandardError('FASTA {} contains no sequence named {}.'.format(fasta_file, contig))
+        if len(records) > 1:
+            raise StandardError(
+                'FASTA {} contains more than one sequence; choose one with --contig.'.format(fasta_file))
+
+        return records[0]
+
+    @staticmethod
+    def load(fasta_file, contig=None):
+        # Reference parsed from the FASTA, with the index from the sidecar
+        # if it was saved for a sequence with the same checksum, otherwise
+        # built and saved to the sidecar
+        name, sequence = Reference.parse(fasta_file, contig)
+        checksum = hashlib.md5(sequence).hexdigest()
+        directory = Reference.sidecar(fasta_file)
+
+        try:
+            index = Reference.loadSidecar(directory, sequence, checksum)
+        except (IOError, OSError, ValueError):
+            index = None
+        if index is not None:
+            return Reference(name, sequence, index)
+
+        reference = Reference(name, sequence)
+        try:
+            reference.save(directory)
+        except (IOError, OSError) as error:
+            sys.stderr.write('Reference index not saved to {}, so it is rebuilt on every run: {}\n'.format(
+                directory, error))
+
+        return reference
+
+    @staticmethod
+    def loadSidecar(directory, sequence, checksum):
+        # ReferenceIndex saved in the sidecar, or None if it was saved for
+        # another sequence or index version
+        key_file = os.path.join(directory, 'key.txt')
+        if not os.path.exists(key_file):
+            return None
+        with open(key_file) as f:
+            if f.read().rstrip('\n') != Reference.sidecarKey(len(sequence), checksum):
+                return None
+
+        return ReferenceIndex(
+            sequence,
+            numpy.load(os.path.join(directory, 'rank.npy')),
+            numpy.load(os.path.join(directory, 'lcp.npy')),
+        )
+
+    def save(self, directory):
+        # The sidecar is built under a temporary name and renamed into
+        # place, so concurrent runs never load a partial one
+        parent = os.path.dirname(os.path.abspath(directory))
+        temporary = tempfile.mkdtemp(dir=parent, prefix='.rotla_index.')
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(temporary, 0777 & ~umask)
+
+        try:
+            with open(os.path.join(temporary, 'reference.txt'), 'w') as OUTPUT:
+                OUTPUT.write(self.name + '\n')
+                OUTPUT.write(self.sequence + '\n')
+                OUTPUT.write('{}\t{}\n'.format('length', self.length))
+                OUTPUT.write('{}\t{}\n'.format('checksum', self.checksum))
+            numpy.save(
+                os.path.join(temporary, 'rank.npy'),
+                numpy.array(self.reference_index.rank, dtype=numpy.int32),
+            )
+            numpy.save(
+                os.path.join(temporary, 'lcp.npy'),
+                numpy.array(self.reference_index.sparse_table[0], dtype=numpy.int32),
+            )
+            with open(os.path.join(temporary, 'key.txt'), 'w') as OUTPUT:
+                OUTPUT.write(Reference.sidecarKey(self.length, self.checksum) + '\n')
+
+            if os.path.isdir(directory):
+                shutil.rmtree(directory)
+            os.rename(temporary, directory)
+        finally:
+            if os.path.isdir(temporary):
+                shutil.rmtree(temporary)
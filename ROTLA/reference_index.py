@@ -0,0 +1,113 @@
+import numpy
+
+
+def suffix_array(seq):
+    # Prefix doubling: rank suffixes by their first k characters, then by
+    # (rank at i, rank at i + k) until every rank is distinct
+    n = len(seq)
+    rank = numpy.frombuffer(seq, dtype=numpy.uint8).astype(numpy.int64)
+
+    k = 1
+    while True:
+        second = numpy.full(n, -1, dtype=numpy.int64)
+        second[:n - k] = rank[k:]
+        order = numpy.lexsort((second, rank))
+
+        changed = (rank[order][1:] != rank[order][:-1]) | \
+            (second[order][1:] != second[order][:-1])
+        new_rank = numpy.empty(n, dtype=numpy.int64)
+        new_rank[order] = numpy.concatenate(([0], numpy.cumsum(changed)))
+        rank = new_rank
+
+        if rank[order[-1]] == n - 1 or k >= n:
+            return order, rank
+        k *= 2
+
+
+def lcp_array(seq, order, rank):
+    # Kasai et al.: lcp[r] is the common prefix length of the suffixes
+    # ranked r - 1 and r
+    n = len(seq)
+    lcp = numpy.zeros(n, dtype=numpy.int64)
+    order = order.tolist()
+    rank = rank.tolist()
+
+    h = 0
+    for i in range(n):
+        if rank[i] > 0:
+            j = order[rank[i] - 1]
+            while i + h < n and j + h < n and seq[i + h] == seq[j + h]:
+                h += 1
+            lcp[rank[i]] = h
+            if h > 0:
+                h -= 1
+        else:
+            h = 0
+
+    return lcp
+
+
+class ReferenceIndex(object):
+    # Suffix array, LCP array and sparse range-minimum table over the
+    # reversed padded reference. The common suffix of padded_seq[:i] and
+    # padded_seq[:j] is then a constant-time lookup, which is how far a
+    # deletion can slide left through a direct repeat. The rank and LCP
+    # arrays can be passed in from a saved index instead of being built.
+
+    def __init__(self, ref_seq, rank=None, lcp=None):
+        self.length = len(ref_seq)
+        self.padded_seq = ref_seq + ref_seq
+        self.reversed_seq = self.padded_seq[::-1]
+
+        if rank is None:
+            order, rank = suffix_array(self.reversed_seq)
+            lcp = lcp_array(self.reversed_seq, order, rank)
+        self.rank = rank.tolist()
+
+        self.sparse_table = [lcp]
+        width = 1
+        while 2 * width <= len(self.reversed_seq):
+            previous = self.sparse_table[-1]
+            self.sparse_table.append(numpy.minimum(previous[:-width], previous[width:]))
+            width *= 2
+        self.sparse_table = [level.tolist() for level in self.sparse_table]
+
+        self.left_aligned = dict()
+
+    def commonSuffix(self, i, j):
+        # Length of the longest common suffix of padded_seq[:i] and
+        # padded_seq[:j]
+        if i == j:
+            return i
+
+        n = len(self.reversed_seq)
+        if i == 0 or j == 0:
+            return 0
+        low, high = sorted([self.rank[n - i], self.rank[n - j]])
+
+        level = (high - low).bit_length() - 1
+        return min(
+            self.sparse_table[level][low + 1],
+            self.sparse_table[level][high - (1 << level) + 1],
+        )
+
+    def leftAlign(self, breakpoint):
+        # Shift a breakpoint left while the last deleted base matches the
+        # base before the deletion; results are cached per raw breakpoint
+        if breakpoint not in self.left_aligned:
+            start, end = breakpoint
+
+            if end < start:
+                end += self.length
+
+            if end - 1 > start:
+                shift = self.commonSuffix(start, end - 1)
+                start -= shift
+                end -= shift
+
+            if end > self.length:
+                end -= self.length
+
+            self.left_aligned[breakpoint] = (start, end)
+
+        return self.left_aligned[breakpoint]
@@ -13,6 +13,7 @@ with open('HISTORY.md') as history_file:
 
 requirements = [
     'Click>=6.0,<=7.1.2',
+    'numpy>=1.11',
 ]
 
 setup(
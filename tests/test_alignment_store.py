@@ -0,0 +1,41 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from ROTLA.alignment_store import KEY_BLOCK_SIZE, input_key
+
+
+class TestInputKey(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.psl = os.path.join(self.directory, 'sample.read_1.psl')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def writePSL(self, middle, tail, mtime=1000000000):
+        with open(self.psl, 'w') as OUTPUT:
+            OUTPUT.write('h' * KEY_BLOCK_SIZE)
+            OUTPUT.write(middle * KEY_BLOCK_SIZE)
+            OUTPUT.write(tail * 100)
+        os.utime(self.psl, (mtime, mtime))
+
+    def test_key_follows_size_time_and_ends(self):
+        self.writePSL('a', 't')
+        key = input_key([self.psl], ['checksum'])
+        self.assertEqual(input_key([self.psl], ['checksum']), key)
+        self.assertNotEqual(input_key([self.psl], ['other checksum']), key)
+
+        # Same size and time, different last block
+        self.writePSL('a', 'u')
+        self.assertNotEqual(input_key([self.psl], ['checksum']), key)
+
+        # Same ends, different modification time
+        self.writePSL('b', 't', mtime=1000000001)
+        self.assertNotEqual(input_key([self.psl], ['checksum']), key)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import unittest
+
+from ROTLA import benchmark
+from ROTLA.batch import find_breakpoints_batch, read_sample_sheet
+from ROTLA.benchmark import PATHS
+
+# Kills the pool worker running it for the sample named crash, and
+# otherwise runs the benchmark's BLAT stand-in
+CRASHING_BLAT = '''#!/bin/sh
+case "$2" in
+    */crash.*) kill -9 $PPID; exit 1 ;;
+esac
+exec {stub} "$@"
+'''
+
+
+class TestFindBreakpointsBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.sample = os.path.join(self.directory, 'sample')
+        benchmark.simulate(self.sample, 200, 1)
+
+        self.blat = os.path.join(self.directory, 'blat')
+        with open(self.blat, 'w') as OUTPUT:
+            OUTPUT.write(CRASHING_BLAT.format(stub=benchmark.write_stub_blat(self.sample)))
+        os.chmod(self.blat, os.stat(self.blat).st_mode | stat.S_IXUSR)
+        self.blat_path = PATHS.get('blat')
+        PATHS['blat'] = self.blat
+
+    def tearDown(self):
+        PATHS['blat'] = self.blat_path
+        shutil.rmtree(self.directory)
+
+    def test_dead_worker_fails_its_sample(self):
+        sample_sheet = os.path.join(self.directory, 'samples.txt')
+        with open(sample_sheet, 'w') as OUTPUT:
+            for name in ['crash', 'ok']:
+                OUTPUT.write('{}\t{}\t{}\n'.format(
+                    os.path.join(self.sample, 'read_1.fastq'),
+                    os.path.join(self.sample, 'read_2.fastq'),
+                    name,
+                ))
+        output_directory = os.path.join(self.directory, 'batch')
+
+        failed = []
+        thread = threading.Thread(target=lambda: failed.extend(find_breakpoints_batch(
+            sample_sheet, os.path.join(self.sample, 'reference.fasta'), output_directory,
+            workers=1, length=25, contig=None, blat_chunks=1, blat_jobs=2,
+            stream_fasta=False, prescreen=False, prescreen_mismatches=0,
+            alignment_cache=False, blat_cache=None, blat_cache_size=50,
+            aligner='blat', collapse_duplicates=False,
+        )))
+        thread.daemon = True
+        thread.start()
+        thread.join(60)
+        self.assertFalse(thread.is_alive())
+
+        self.assertEqual(failed, ['crash'])
+        with open(os.path.join(output_directory, 'samples.txt')) as f:
+            status = [line.rstrip('\n').split('\t')[:2] for line in f]
+        self.assertEqual(status, [['crash', 'failed'], ['ok', 'ok']])
+        self.assertFalse(os.path.exists(os.path.join(output_directory, 'crash.read_1.fasta')))
+        self.assertTrue(os.path.exists(os.path.join(output_directory, 'ok.breakpoints.txt')))
+
+
+class TestReadSampleSheet(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.sample_sheet = os.path.join(self.directory, 'samples.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def writeSheet(self, text):
+        with open(self.sample_sheet, 'w') as OUTPUT:
+            OUTPUT.write(text)
+
+    def test_columns_split_on_tabs(self):
+        self.writeSheet('run 1/a_R1.fastq\trun 1/a_R2.fastq\tsample a\n\nb_R1.fastq\tb_R2.fastq\tb\n')
+        self.assertEqual(read_sample_sheet(self.sample_sheet), [
+            ('run 1/a_R1.fastq', 'run 1/a_R2.fastq', 'sample a'),
+            ('b_R1.fastq', 'b_R2.fastq', 'b'),
+        ])
+
+    def test_wrong_column_count_names_the_line(self):
+        self.writeSheet('a_R1.fastq\ta_R2.fastq\ta\nb_R1.fastq b_R2.fastq b\n')
+        with self.assertRaisesRegexp(StandardError, 'Line 2 .* has 1 tab-separated columns'):
+            read_sample_sheet(self.sample_sheet)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,27 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from ROTLA.benchmark import run_benchmark
+
+GOLDEN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'docs', 'benchmark_golden')
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_multi_hit_simulation_matches_golden(self):
+        # Split reads with many hits, some across the origin, as recorded
+        # in docs/benchmark_golden
+        mismatches = run_benchmark(self.directory, [250], multi_hits=10, golden=GOLDEN)
+        self.assertEqual(mismatches, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
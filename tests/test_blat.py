@@ -0,0 +1,85 @@
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import unittest
+
+from subprocess import CalledProcessError
+
+from ROTLA.blat import run_blat
+
+# Stand-in for BLAT that fails on read 1 without opening its FASTA, and
+# otherwise copies the FASTA into the PSL file after a five-line header
+STUB_BLAT = '''#!/bin/sh
+case "$2" in
+    *read_1*) exit 3 ;;
+esac
+printf 'h\\nh\\nh\\nh\\nh\\n' > "$3"
+exec cat "$2" >> "$3"
+'''
+
+
+def write_records(handles):
+    for i in range(20000):
+        for input_handles in handles:
+            input_handles[i % len(input_handles)].write('>read{}\nACGT\n'.format(i))
+
+
+class TestRunBlat(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.blat = os.path.join(self.directory, 'blat')
+        with open(self.blat, 'w') as OUTPUT:
+            OUTPUT.write(STUB_BLAT)
+        os.chmod(self.blat, os.stat(self.blat).st_mode | stat.S_IXUSR)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def runBlat(self, reads, chunks):
+        # run_blat on streamed reads in a thread, so a hang fails the test
+        # instead of the test run
+        files = [
+            [os.path.join(self.directory, read + extension) for read in reads]
+            for extension in ['.fasta', '.psl', '.blat.out']
+        ]
+        result = []
+
+        def run():
+            try:
+                run_blat(self.blat, 'reference.fasta', *files, chunks=chunks, writer=write_records)
+                result.append(None)
+            except Exception as error:
+                result.append(error)
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        thread.join(30)
+        self.assertFalse(thread.is_alive(), 'run_blat did not return')
+
+        return result[0]
+
+    def test_streamed_failure_raises(self):
+        for chunks in [1, 3]:
+            error = self.runBlat(['read_1', 'read_2'], chunks)
+            self.assertIsInstance(error, CalledProcessError)
+            self.assertEqual(error.returncode, 3)
+            self.assertFalse([
+                name for name in os.listdir(self.directory)
+                if name.endswith('.fasta')
+            ])
+
+    def test_streamed_success(self):
+        for chunks in [1, 3]:
+            self.assertIsNone(self.runBlat(['read_2', 'read_3'], chunks))
+            for read in ['read_2', 'read_3']:
+                with open(os.path.join(self.directory, read + '.psl')) as f:
+                    lines = f.readlines()
+                self.assertEqual(len(lines), 5 + 2 * 20000)
+
+
+if __name__ == '__main__':
+    unittest.main()
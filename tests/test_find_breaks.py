@@ -0,0 +1,55 @@
+import copy
+import shutil
+import tempfile
+import unittest
+
+from ROTLA import benchmark
+from ROTLA.ROTLA import ROTLA
+
+
+class CheckedROTLA(ROTLA):
+    # Runs findBreaksByRead after findBreaks and keeps both results
+
+    found = []
+
+    def findBreaks(self):
+        ROTLA.findBreaks(self)
+        by_table = copy.deepcopy(self.breakpoints)
+
+        self.breakpoints = dict()
+        self.findBreaksByRead()
+        self.found.append((by_table, copy.deepcopy(self.breakpoints)))
+
+
+class TestFindBreaks(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        CheckedROTLA.found = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def checkSimulation(self, pairs, multi_hits):
+        benchmark.simulate(self.directory, pairs, 1, multi_hits=multi_hits)
+        benchmark.ROTLA = CheckedROTLA
+        try:
+            benchmark.run_simulation(self.directory)
+        finally:
+            benchmark.ROTLA = ROTLA
+
+        self.assertEqual(len(CheckedROTLA.found), 1)
+        by_table, by_read = CheckedROTLA.found[0]
+        self.assertTrue(by_table)
+        self.assertEqual(by_table, by_read)
+
+    def test_simulated_reads(self):
+        self.checkSimulation(1000, 0)
+
+    def test_simulated_reads_with_many_hits(self):
+        # Minus strand hits and hits across the origin
+        self.checkSimulation(250, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
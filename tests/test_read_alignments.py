@@ -0,0 +1,70 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from ROTLA.ROTLA import ROTLA
+from ROTLA.alignment_store import AlignmentStore
+
+
+class PSLReader(ROTLA):
+    # readAlignments on given PSL files, without reads or a reference
+
+    def __init__(self):
+        self.alignment = AlignmentStore()
+        self.aligned_base_counter = None
+        self.pair_copies = dict()
+        self.ref_seq_length = 16569
+
+
+def psl_line(qName, block_sizes, t_starts):
+    sizes = [int(size) for size in block_sizes]
+    q_starts = [sum(sizes[:i]) for i in range(len(sizes))]
+    return '\t'.join(str(field) for field in [
+        sum(sizes), 0, 0, 0, 0, 0, len(sizes) - 1, 0, '+', qName, 100, 0, 100,
+        'chrM', 16569, t_starts[0], t_starts[-1] + sizes[-1], len(sizes),
+        ''.join('{},'.format(size) for size in sizes),
+        ''.join('{},'.format(start) for start in q_starts),
+        ''.join('{},'.format(start) for start in t_starts),
+    ]) + '\n'
+
+
+class TestReadAlignments(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def writePSL(self, name, lines):
+        psl = os.path.join(self.directory, name)
+        with open(psl, 'w') as OUTPUT:
+            OUTPUT.write('h\n' * 5)
+            OUTPUT.writelines(lines)
+        return psl
+
+    def test_repeated_query_keeps_every_group(self):
+        # pair1 turns up twice in read 1 while waiting on read 2
+        read_1_psl = self.writePSL('read_1.psl', [
+            psl_line('pair1', [50, 50], [100, 5000]),
+            psl_line('pair2', [100], [300]),
+            psl_line('pair1', [50, 50], [200, 6000]),
+        ])
+        read_2_psl = self.writePSL('read_2.psl', [
+            psl_line('pair3', [100], [400]),
+            psl_line('pair4', [100], [500]),
+            psl_line('pair5', [100], [600]),
+            psl_line('pair1', [100], [700]),
+        ])
+
+        reader = PSLReader()
+        reader.readAlignments(read_1_psl, read_2_psl)
+
+        self.assertEqual(len(list(reader.alignment.alignments('pair1', 'read_1'))), 2)
+        self.assertEqual(len(list(reader.alignment.alignments('pair1', 'read_2'))), 1)
+        self.assertEqual(reader.psl_stats['lines'], 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
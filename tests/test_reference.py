@@ -0,0 +1,62 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from StringIO import StringIO
+
+from ROTLA.reference import Reference
+
+
+class TestReference(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.fasta = os.path.join(self.directory, 'reference.fasta')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def writeFASTA(self, sequence):
+        with open(self.fasta, 'w') as OUTPUT:
+            OUTPUT.write('>chrM\n{}\n'.format(sequence))
+
+    def test_sidecar_checked_against_sequence(self):
+        self.writeFASTA('ACGTTGCAACGGT' * 20)
+        os.utime(self.fasta, (1000000000, 1000000000))
+        Reference.load(self.fasta)
+        self.assertTrue(os.path.isdir(Reference.sidecar(self.fasta)))
+
+        # Same size and modification time, different sequence
+        self.writeFASTA('TTGCAACGGTACG' * 20)
+        os.utime(self.fasta, (1000000000, 1000000000))
+
+        reference = Reference.load(self.fasta)
+        expected = Reference('chrM', 'TTGCAACGGTACG' * 20)
+        self.assertEqual(reference.sequence, expected.sequence)
+        self.assertEqual(list(reference.reference_index.rank), list(expected.reference_index.rank))
+
+        # Unchanged sequence loads the saved index
+        loaded = Reference.load(self.fasta)
+        self.assertEqual(list(loaded.reference_index.rank), list(expected.reference_index.rank))
+
+    def test_warns_when_sidecar_cannot_be_saved(self):
+        self.writeFASTA('ACGTTGCAACGGT' * 20)
+        with open(Reference.sidecar(self.fasta), 'w') as OUTPUT:
+            OUTPUT.write('not a directory\n')
+
+        stderr = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            reference = Reference.load(self.fasta)
+            warning = sys.stderr.getvalue()
+        finally:
+            sys.stderr = stderr
+
+        self.assertEqual(reference.sequence, 'ACGTTGCAACGGT' * 20)
+        self.assertIn('Reference index not saved', warning)
+
+
+if __name__ == '__main__':
+    unittest.main()